@@ -1,6 +1,6 @@
 #! /usr/local/bin/python
 
-import math
+import array, math, schemautil
 
 three_to_one_map =  {'ALA':'A', 'CYS':'C', 'ASP':'D', 'GLU':'E', 'PHE':'F', \
 			'GLY':'G', 'HIS':'H', 'ILE':'I', 'LYS':'K', 'LEU':'L', \
@@ -14,18 +14,64 @@ class Atom:
 	
 	# Field definitions taken from https://www.cgl.ucsf.edu/chimera/docs/UsersGuide/tutorials/pdbintro.html
 	
+	# Fields are parsed from the line when first used; the coordinates and atom
+	# name, which distance checks use over and over, are then kept.
+	__slots__ = ('line', '_x', '_y', '_z', '_atom_name')
+
 	def __init__(self, line):
 		self.line = line
-		self.x = self.getX()
-		self.y = self.getY()
-		self.z = self.getZ()
-		self.chain = self.getChainID()
-		self.atom_name = self.getAtomName()
-		self.alt_loc = self.getAltLoc()
-		self.res_seq = self.getResidueSequenceNumber()
-		self.icode = self.getInsertionCode()
-		self.residue = self.getResidue()
-		self.res_id = self.getResidueID()
+		self._x = None
+		self._y = None
+		self._z = None
+		self._atom_name = None
+
+	@property
+	def x(self):
+		if self._x is None:
+			self._x = self.getX()
+		return self._x
+
+	@property
+	def y(self):
+		if self._y is None:
+			self._y = self.getY()
+		return self._y
+
+	@property
+	def z(self):
+		if self._z is None:
+			self._z = self.getZ()
+		return self._z
+
+	@property
+	def atom_name(self):
+		if self._atom_name is None:
+			self._atom_name = self.getAtomName()
+		return self._atom_name
+
+	@property
+	def chain(self):
+		return self.getChainID()
+
+	@property
+	def alt_loc(self):
+		return self.getAltLoc()
+
+	@property
+	def res_seq(self):
+		return self.getResidueSequenceNumber()
+
+	@property
+	def icode(self):
+		return self.getInsertionCode()
+
+	@property
+	def residue(self):
+		return self.getResidue()
+
+	@property
+	def res_id(self):
+		return self.getResidueID()
 
 	def getResidue(self):
 		return (self.line[17:20]).strip()
@@ -120,29 +166,198 @@ class Residue:
 					return True
 		return False
 	
+	def contactCoordinates(self):
+		"""Returns the (x, y, z) coordinates of the atoms considered by isContact."""
+		atoms_to_exclude = ['H', 'O'] # exclude hydrogens and backbone oxygens
+		return [(atom.x, atom.y, atom.z) for atom in self.atoms[1:] if atom.atom_name not in atoms_to_exclude]
+
 	def __repr__(self):
 		return '%s %d' % (self.residue, self.res_seq)
 
+class AtomView:
+	"An atom of a Structure, read from its arrays"
+	__slots__ = ('structure', 'index')
+
+	def __init__(self, structure, index):
+		self.structure = structure
+		self.index = index
+
+	@property
+	def x(self):
+		return self.structure.coords[3*self.index]
+
+	@property
+	def y(self):
+		return self.structure.coords[3*self.index+1]
+
+	@property
+	def z(self):
+		return self.structure.coords[3*self.index+2]
+
+	@property
+	def atom_name(self):
+		return self.structure.atom_names[self.structure.atom_name_codes[self.index]]
+
+	@property
+	def chain(self):
+		return chr(self.structure.chain_codes[self.index])
+
+	@property
+	def alt_loc(self):
+		return chr(self.structure.alt_loc_codes[self.index])
+
+	def getResidueView(self):
+		return self.structure.residues[self.structure.residue_index[self.index]]
+
+	@property
+	def residue(self):
+		return self.getResidueView().residue
+
+	@property
+	def res_seq(self):
+		return self.getResidueView().res_seq
+
+	@property
+	def icode(self):
+		# The atoms of a residue share its ID, which ends with the insertion code
+		return self.getResidueView().res_id[-1]
+
+	@property
+	def res_id(self):
+		return self.getResidueView().res_id
+
+	def getCoords(self):
+		return self.x, self.y, self.z
+
+	def getDistance(self, atom):
+		return math.sqrt((self.x-atom.x)**2 + (self.y-atom.y)**2 + (self.z-atom.z)**2)
+
+	def __repr__(self):
+		return '%s %d %s (%1.3f, %1.3f, %1.3f)' % (self.residue, self.res_seq, self.atom_name, self.x, self.y, self.z)
+
+class ResidueView(Residue):
+	"A residue of a Structure, covering its atoms start to stop-1"
+	def __init__(self, structure, start, stop, residue, res_seq, res_id, chain):
+		self.structure = structure
+		self.start = start
+		self.stop = stop
+		self.residue = residue
+		self.res_seq = res_seq
+		self.res_id = res_id
+		self.chain = chain
+
+	@property
+	def atoms(self):
+		return [AtomView(self.structure, k) for k in range(self.start, self.stop)]
+
+	def contactCoordinates(self):
+		"""Returns the (x, y, z) coordinates of the atoms considered by isContact."""
+		coords = self.structure.coords
+		excluded = self.structure.excludedNameCodes(['H', 'O'])
+		names = self.structure.atom_name_codes
+		return [(coords[3*k], coords[3*k+1], coords[3*k+2]) for k in range(self.start+1, self.stop) if names[k] not in excluded]
+
+class Structure:
+	"""Atoms of a PDB file stored as parallel arrays rather than as one object per atom.
+
+	coords holds x, y, z for each atom in turn, residue_index the index of each
+	atom's residue in residues, atom_name_codes indices into atom_names,
+	and chain_codes and alt_loc_codes the character codes of each atom's chain
+	and alternate location indicator.  residues holds a
+	ResidueView for each list of ATOM lines in residue_lines, as produced by
+	groupResidueLines."""
+	def __init__(self, residue_lines):
+		self.coords = array.array('d')
+		self.residue_index = array.array('l')
+		self.atom_name_codes = array.array('H')
+		self.chain_codes = array.array('B')
+		self.alt_loc_codes = array.array('B')
+		self.atom_names = []
+		self.residues = []
+		name_codes = {}
+		for lines in residue_lines:
+			line = lines[0]
+			res_seq = int(line[22:26])
+			start = len(self.residue_index)
+			residue = ResidueView(self, start, start+len(lines), line[17:20].strip(), res_seq, ('%d'%res_seq)+line[26], line[21])
+			self.residues.append(residue)
+			for line in lines:
+				atom_name = line[12:16].strip()
+				if atom_name not in name_codes:
+					name_codes[atom_name] = len(self.atom_names)
+					self.atom_names.append(atom_name)
+				self.coords.extend((float(line[30:38]), float(line[38:46]), float(line[46:54])))
+				self.residue_index.append(len(self.residues)-1)
+				self.atom_name_codes.append(name_codes[atom_name])
+				self.chain_codes.append(ord(line[21]))
+				self.alt_loc_codes.append(ord(line[16]))
+
+	def __len__(self):
+		return len(self.residue_index)
+
+	def excludedNameCodes(self, atom_names):
+		return set([k for k in range(len(self.atom_names)) if self.atom_names[k] in atom_names])
+
+def parseHeader(line):
+	"Extracts the fields of a PDB file HEADER line"
+	return {'classification':line[10:50].strip(), 'deposition_date':line[50:59].strip(), 'id_code':line[62:66]}
+
+def readAtomLines(f, header=None, record_filter=None):
+	"""Yields the ATOM lines of a PDB file as it is read, only those for which
+	record_filter(line) is true if it is given.  If a header dictionary is given,
+	the fields of the first HEADER line are stored in it."""
+	for line in f:
+		if line[0:4] == 'ATOM':
+			if record_filter is None or record_filter(line):
+				yield line
+		elif line[0:6] == 'HEADER' and header is not None and not header:
+			header.update(parseHeader(line))
+
+def groupResidueLines(atom_lines, chains=None):
+	"""Yields lists of consecutive ATOM lines sharing a residue ID, one list per residue.
+	If chains is given, residues whose first atom is in another chain are skipped
+	without their lines being kept."""
+	lines = []
+	res_id = None
+	keep = False
+	for line in atom_lines:
+		line_res_id = ('%d'%int(line[22:26]))+line[26]
+		if res_id is None or line_res_id != res_id:
+			if lines:
+				yield lines
+				lines = []
+			res_id = line_res_id
+			keep = chains is None or line[21] in chains
+		if keep:
+			lines.append(line)
+	if lines:
+		yield lines
+
 class File:
 	def __init__(self):
 		self.residues = []
+		self.header = {}
 		
-	def read(self, f):
-		lines = f.readlines()
-		atom_lines = []
-		for line in lines:
-			if line[0:4] == 'ATOM':
-				atom_lines.append(line)
-				#print(pdb_reader.Atom(line))
-
-		while atom_lines != []:
-			residue = Residue(atom_lines)
-			self.residues.append(residue)
-			atom_lines = atom_lines[len(self.residues[-1].atoms):]
+	def read(self, f, arrays=False, chains=None, record_filter=None):
+		"""Reads the residues of a PDB file in a single pass, storing the HEADER fields
+		in self.header.  With chains, only residues in those chains are read, and with
+		record_filter only the ATOM lines for which record_filter(line) is true.  With
+		arrays, the atoms are stored in a Structure (kept as self.structure) and the
+		residues are views onto it.  The file may be gzip or bzip2 compressed."""
+		self.header = {}
+		atom_lines = readAtomLines(schemautil.openInput(f), self.header, record_filter)
+		residue_lines = groupResidueLines(atom_lines, chains)
+		if arrays:
+			self.structure = Structure(residue_lines)
+			self.residues.extend(self.structure.residues)
+			return self.residues
+
+		for lines in residue_lines:
+			self.residues.append(Residue(lines))
 		return self.residues
 	
 	def getIDCode(self, f):
-		for line in f.readlines():
+		for line in schemautil.openInput(f):
 			if line[0:6] == 'HEADER':
 				return line[62:66]
 		return None
@@ -1,6 +1,8 @@
 #! /usr/local/bin/python
 
-import math, time, schema
+import array, math, time, schema
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 HUGE_NUMBER = 1.0e10
 
@@ -75,11 +77,73 @@ class Path:
 		return [l - k for (k, l) in self.frags(parent)]
 
 
-def make_2d_array(dim1, dim2, init_value=0.0):
-	arr = []
-	for _ in range(dim1):
-		arr.append([init_value] * dim2)
-	return arr
+def make_2d_array(dim1, dim2, init_value=0.0, typecode="d"):
+	"""Returns a dim1 x dim2 matrix stored in one contiguous array.
+
+	The matrix is a list of rows, each a view into the array, so that
+	matrix[i][j] reads and writes it as with nested lists.  The default
+	typecode "d" stores float64; "f" stores float32 in half the memory."""
+	data = array.array(typecode, [init_value]) * (dim1 * dim2)
+	view = memoryview(data)
+	return [view[i * dim2 : (i + 1) * dim2] for i in range(dim1)]
+
+
+def make_triangular_array(dim, init_value=0.0, typecode="d"):
+	"""Returns a dim x dim upper-triangular matrix, diagonal included, packed
+	into one contiguous array of dim*(dim+1)/2 entries.
+
+	As with make_2d_array, matrix[i][j] works for any column j of row i, but
+	only entries with j >= i are stored: entries below the diagonal belong to
+	other rows and must not be used."""
+	data = array.array(typecode, [init_value]) * (dim * (dim + 1) // 2)
+	return triangular_rows(data, dim)
+
+
+def make_banded_array(dim, width, init_value=0.0, typecode="d"):
+	"""Returns a dim x dim band matrix holding entries (i, j) with
+	i <= j < i + width, packed into one contiguous array of dim*width entries.
+
+	As with make_triangular_array, matrix[i][j] works for the full column
+	number j, but entries outside the band belong to other rows and must not
+	be used."""
+	data = array.array(typecode, [init_value]) * (dim * width)
+	return banded_rows(data, dim, width)
+
+
+def band_width(dim, max_length):
+	"""Returns the width of a dim x dim band matrix holding the entries (i, j)
+	with j - i <= max_length, or None if max_length is None or the band would
+	not be smaller than the packed upper triangle."""
+	if max_length is None:
+		return None
+	width = min(max_length, dim) + 1
+	if dim * width >= dim * (dim + 1) // 2:
+		return None
+	return width
+
+
+def banded_rows(data, dim, width):
+	"""Builds the row views of a packed band matrix over data."""
+	view = memoryview(data)
+	# Entry (i, j) is stored at i*width + (j - i), so row i begins at
+	# i*(width - 1) when indexed by the full column number.
+	return [
+		view[i * (width - 1) : i * (width - 1) + min(dim, i + width)]
+		for i in range(dim)
+	]
+
+
+def triangular_rows(data, dim):
+	"""Builds the row views of a packed upper-triangular matrix over data."""
+	view = memoryview(data)
+	rows = []
+	# start is the offset of entry (i, i).  Each row view begins i entries
+	# earlier so that it can be indexed by the full column number.
+	start = 0
+	for i in range(dim):
+		rows.append(view[start - i : start - i + dim])
+		start += dim - i
+	return rows
 
 
 def min_index(arr):
@@ -132,71 +196,111 @@ def order_contacts(contacts):
 	return new_contacts
 
 
-def make_4d_energies(contacts, parents):
-	"""RICE scoring is applied here"""
+class PenaltyTable:
+	"""RICE penalties for every contact and every ordered pair of parents.
 
-	ordered_contacts = order_contacts(contacts)
-	energies = []
-	for (i, j, ri, rj) in ordered_contacts:
-		for p in range(len(parents)):
-			parp = parents[p]
-			for q in range(len(parents)):
-				if p != q:
+	The penalties are stored as a flat array of shape
+	contacts x parents x parents: the penalty for contact c when residue i
+	comes from parent p and residue j from parent q is
+	penalties[(c * num_parents + p) * num_parents + q]."""
 
-					parq = parents[q]
-					pair = (parp[i], parq[j])
+	def __init__(self, contacts, num_parents):
+		self.contacts = contacts
+		self.num_parents = num_parents
+		self.penalties = array.array("B", bytes(len(contacts) * num_parents**2))
 
-					comp_pairs = [pair]
+	def contact_penalties(self, c):
+		"""Returns the parents x parents block of penalties for contact c."""
+		block = self.num_parents**2
+		return self.penalties[c * block : (c + 1) * block]
 
-					if pair[0] in compatibility:
-						for rc in compatibility[pair[0]]:
-							comp_pairs.append((rc, pair[1]))
 
-					if pair[1] in compatibility:
-						for rc in compatibility[pair[1]]:
-							comp_pairs.append((pair[0], rc))
+def encode_compatibility(compatibility):
+	"""Converts a residue compatibility table to byte codes."""
+	return dict(
+		(ord(res), tuple(ord(rc) for rc in compatible))
+		for (res, compatible) in compatibility.items()
+	)
+
 
-					parent_pairs = [(r[i], r[j]) for r in parents]
+byte_compatibility = encode_compatibility(compatibility)
 
-					if pair not in parent_pairs:
-						for parent_pair in parent_pairs:
-							if parent_pair in comp_pairs[1:]: 
-								apply_penalties(energies, (i, j, p, q), 1)
-								break
-						else:
-							apply_penalties(energies, (i, j, p, q), 2)
 
-	return energies
+def make_4d_energies(contacts, parents):
+	"""RICE scoring is applied here.
 
+	Returns a PenaltyTable for the ordered contacts.  A pair of residues
+	found in any parent costs nothing, a pair that is only compatible with
+	a parental pair costs 1, and any other pair costs 2."""
 
-def apply_penalties(e, d, max):
-	for _ in range(max):
-		e.append(d)
+	ordered_contacts = order_contacts(contacts)
+	num_parents = len(parents)
+	table = PenaltyTable(ordered_contacts, num_parents)
+	penalties = table.penalties
+
+	# Work on byte codes rather than characters so that residue pairs are
+	# cheap to build and compare.
+	columns = schema.asAlignment(parents).columns
+
+	k = 0
+	for (i, j, ri, rj) in ordered_contacts:
+		residues_i = columns[i]
+		residues_j = columns[j]
+		parent_pairs = set(zip(residues_i, residues_j))
+		# The penalty only depends on the residues, so work it out once per
+		# distinct residue pair in this contact.
+		pair_penalties = {}
+		for a in residues_i:
+			for b in residues_j:
+				pair = (a, b)
+				if pair in pair_penalties:
+					continue
+				if pair in parent_pairs:
+					pair_penalties[pair] = 0
+				elif any(
+					(rc, b) in parent_pairs for rc in byte_compatibility.get(a, ())
+				) or any(
+					(a, rc) in parent_pairs for rc in byte_compatibility.get(b, ())
+				):
+					pair_penalties[pair] = 1
+				else:
+					pair_penalties[pair] = 2
+		for a in residues_i:
+			for b in residues_j:
+				penalties[k] = pair_penalties[(a, b)]
+				k += 1
+
+	return table
+
+
+def calc_penalty_counts(energies):
+	"""Sum the penalties between pairs of residues over every pair of parents,
+	given the PenaltyTable from make_4d_energies.  Returns (i, j, count)
+	triples with integer counts; dividing a count by the number of parent
+	pairs gives the average energy from calc_average_energies.
+
+	Only residue pairs that have at least one penalty are returned."""
+	# A contact may be listed more than once, in which case its penalties add up.
+	penalty_counts = {}
+	for c in range(len(energies.contacts)):
+		(i, j, ri, rj) = energies.contacts[c]
+		total = sum(energies.contact_penalties(c))
+		if total:
+			penalty_counts[(i, j)] = penalty_counts.get((i, j), 0) + total
+	return [(i, j, penalty_counts[(i, j)]) for (i, j) in sorted(penalty_counts)]
 
 
 def calc_average_energies(energies, parents):
 	"""Calculate the average disruption between pairs of residues across
-	all the parents"""
-	num_residues = len(parents[0])
-	num_parents = len(parents)
-	avg_energies = []
-	
-	for i in range(num_residues - 1):
-		for j in range(i + 1, num_residues):
-
-			ij = [(ri, rj, p, q) for (ri, rj, p, q) in energies if ri == i and rj == j]
-			
-			nij = len(ij)
-			nij_same = len(
-				[(ri, rj) for (ri, rj, p, q) in ij if ri == i and rj == j and p == q]
-			)
-			
-			# print i, j, nij, nij_same
-			diff = nij - nij_same
-			avg = float(diff) / (num_parents**2)
-			avg_energies.append((i, j, avg))
+	all the parents, given the PenaltyTable from make_4d_energies.
 
-	return avg_energies
+	Only residue pairs that have at least one penalty are returned; every
+	other pair has an average energy of zero."""
+	num_parents = len(parents)
+	return [
+		(i, j, float(count) / (num_parents**2))
+		for (i, j, count) in calc_penalty_counts(energies)
+	]
 
 
 def avg_energy_list_to_matrix(avg_energies, num_residues, init_value=0.0):
@@ -219,22 +323,56 @@ def calc_average_library_energy(avg_energy_matrix, num_residues, xover1, xover2)
 	return lib_avg_energy
 
 
-def calc_arc_lengths(avg_energies, parents):
+def calc_arc_lengths(
+	avg_energies, parents, typecode="d", packed=False, max_length=None
+):
 	# Calculate the lengths, in average energies, from crossovers starting
 	# at residue r1 to residue r2.
 	# The fragments here begin at r1 and end at r2-1
+	# Only r1 < r2 has an arc, so with packed=True just the upper triangle is
+	# stored (see make_triangular_array).  With max_length, only arcs with
+	# r2 - r1 <= max_length are computed, and they are stored as a band (see
+	# make_banded_array) when that is smaller than the packed triangle, so
+	# memory grows with the sequence length times max_length.
 	num_residues = len(parents[0])
-	num_parents = len(parents)
-	avg_energy_matrix = avg_energy_list_to_matrix(avg_energies, num_residues, 0.0)
 
-	arc_lengths = make_2d_array(num_residues, num_residues, HUGE_NUMBER)
-	for r1 in range(num_residues - 1):
-		for r2 in range(r1 + 1, num_residues):
-			avg_energy = calc_average_library_energy(
-				avg_energy_matrix, num_residues, r1, r2
-			)
+	# The average energies between residue r2 and the residues before it,
+	# as (i, avg) pairs.  As in avg_energy_list_to_matrix, a later entry for
+	# the same pair of residues replaces an earlier one.
+	pair_energies = {}
+	for (i, j, avg) in avg_energies:
+		pair_energies[(min(i, j), max(i, j))] = avg
+
+	column_energies = [[] for r2 in range(num_residues)]
+	for (i, j) in sorted(pair_energies):
+		if i != j:
+			column_energies[j].append((i, pair_energies[(i, j)]))
+
+	# arc_lengths[r1][r2] is the same sum that calc_average_library_energy
+	# computes, but built from cumulative sums rather than re-summing the block
+	# for every (r1, r2).  Walking r2 down from the end of the protein,
+	# row_sums[i] holds the energy between residue i and residues r2 onwards,
+	# and the arc for r1 is the arc for r1+1 plus row_sums[r1].
+	width = band_width(num_residues, max_length)
+	if width is not None:
+		arc_lengths = make_banded_array(num_residues, width, HUGE_NUMBER, typecode)
+	elif packed or max_length is not None:
+		arc_lengths = make_triangular_array(num_residues, HUGE_NUMBER, typecode)
+	else:
+		arc_lengths = make_2d_array(num_residues, num_residues, HUGE_NUMBER, typecode)
+	if max_length is None:
+		max_length = num_residues
+	# Integer energies, such as the counts from calc_penalty_counts, are summed
+	# exactly, so equal arcs are exactly equal whatever the summation order.
+	row_sums = [0] * num_residues
+	for r2 in range(num_residues - 1, 0, -1):
+		for (i, avg) in column_energies[r2]:
+			row_sums[i] += avg
+		avg_energy = 0
+		for r1 in range(r2 - 1, max(r2 - max_length, 0) - 1, -1):
+			avg_energy += row_sums[r1]
 			arc_lengths[r1][r2] = avg_energy
-	
+
 	return arc_lengths
 
 
@@ -255,10 +393,9 @@ def collapse_parents(parents):
 	if len(parents) < 2:
 		return parents, []
 
+	conserved = schema.asAlignment(parents).conserved
 	for i in range(len(parents[0])):
-		sites = [p[i] for p in parents]
-		c = sites.count(sites[0])
-		if c == num_parents:  # All parents have same residue
+		if conserved[i]:  # All parents have same residue
 			# So store the position of the identity
 			identity_list.append(i)
 	# If there are no identities, bail.
@@ -283,23 +420,38 @@ def collapse_parents(parents):
 
 
 def collapse_matrix(matrix, identical_sites):
-	dim = len(matrix)
-	nsites = len(identical_sites)
-	new_matrix = []
-	for i in range(dim - nsites):
-		new_matrix.append([0.0] * (dim - nsites))
+	# Take the rows and columns of the non-identical sites by index.
+	identical = set(identical_sites)
+	keep = [i for i in range(len(matrix)) if i not in identical]
+	new_matrix = make_2d_array(len(keep), len(keep), 0.0)
+	for k in range(len(keep)):
+		row = matrix[keep[k]]
+		new_row = new_matrix[k]
+		for l in range(len(keep)):
+			new_row[l] = row[keep[l]]
+	return new_matrix
+
 
+def collapse_avg_energies(avg_energies, identical_sites, num_residues):
+	"""Converts (i, j, avg) average energies on the full-length parents into
+	average energies on parents whose identical sites have been removed.
+	Entries involving an identical site are dropped."""
+	identical = set(identical_sites)
+	collapsed_index = []
 	k = 0
-	l = 0
-	for i in range(len(matrix)):
-		if not i in identical_sites:
-			l = 0
-			for j in range(len(matrix[i])):
-				if not j in identical_sites:
-					new_matrix[k][l] = matrix[i][j]
-					l += 1
+	for i in range(num_residues):
+		if i in identical:
+			collapsed_index.append(None)
+		else:
+			collapsed_index.append(k)
 			k += 1
-	return new_matrix
+
+	collapsed_avg_energies = []
+	for (i, j, avg) in avg_energies:
+		(ci, cj) = (collapsed_index[i], collapsed_index[j])
+		if ci is not None and cj is not None:
+			collapsed_avg_energies.append((ci, cj, avg))
+	return collapsed_avg_energies
 
 
 def translate_collapsed_indices(collapsed_crossovers, collapsed_sites):
@@ -317,12 +469,22 @@ def translate_collapsed_indices(collapsed_crossovers, collapsed_sites):
 	return crossovers
 
 
-def RASPP_SCHEMA(contacts, parents, num_crossovers, min_fragment_diversity):
-	schema_contacts = schema.getSCHEMAContacts(contacts, parents)
-	(collapsed_parents, identity_list) = collapse_parents(parents)
-	energies = make_4d_energies(schema_contacts, parents)
-	avg_energies = calc_average_energies(energies, parents)
-	results = RASPP(avg_energies, parents, num_crossovers, min_fragment_diversity)
+def RASPP_SCHEMA(
+	contacts, parents, num_crossovers, min_fragment_diversity, workers=1
+):
+	alignment = schema.Alignment(parents)
+	schema_contacts = schema.getSCHEMAContacts(contacts, alignment)
+	(collapsed_parents, identity_list) = collapse_parents(alignment)
+	energies = make_4d_energies(schema_contacts, alignment)
+	penalty_counts = calc_penalty_counts(energies)
+	results = RASPP(
+		penalty_counts,
+		parents,
+		num_crossovers,
+		min_fragment_diversity,
+		workers,
+		counts=True,
+	)
 
 	for i in range(len(results)):
 		(avg_E, collapsed_crossovers, l_min, l_max) = results[i]
@@ -331,8 +493,24 @@ def RASPP_SCHEMA(contacts, parents, num_crossovers, min_fragment_diversity):
 	return results
 
 
-def RASPP(avg_energies, parents, num_crossovers, min_fragment_diversity):
-	"""Find libraries with the lowest energy given constraints on fragment diversity."""
+def RASPP(
+	avg_energies,
+	parents,
+	num_crossovers,
+	min_fragment_diversity,
+	workers=1,
+	max_fragment_diversity=None,
+	counts=False,
+):
+	"""Find libraries with the lowest energy given constraints on fragment diversity.
+
+	With workers > 1, the l_min values are divided among that many processes.
+	With max_fragment_diversity, no fragment is longer than that, and only the
+	band of arc lengths up to that length is stored, which keeps memory in
+	check for long sequences.  With counts=True, avg_energies are the integer
+	penalty counts from calc_penalty_counts: paths are then found on exact
+	whole-number lengths, so libraries with equal energies tie exactly, and
+	the energies are divided by the number of parent pairs when reported."""
 
 	# Collapse the parents to remove identical sites.  Necessary because RASPP's
 	# definition of fragment "length" -- the number of changed residues in a fragment --
@@ -346,140 +524,268 @@ def RASPP(avg_energies, parents, num_crossovers, min_fragment_diversity):
 			len(collapsed_parents[0]),
 		)
 		raise ValueError(err_string)
+	if (
+		max_fragment_diversity is not None
+		and (num_crossovers + 1) * max_fragment_diversity < len(collapsed_parents[0])
+	):
+		err_string = "%d crossovers with maximum fragment length of %d " % (
+			num_crossovers,
+			max_fragment_diversity,
+		) + "is impossible given parent non-identical sequence length of %d." % (
+			len(collapsed_parents[0]),
+		)
+		raise ValueError(err_string)
 
 	results = []
-	# Compute the arc lengths.
+	# Compute the arc lengths on the collapsed parents.  Identical sites
+	# cannot be disrupted, so dropping them from the average energies first
+	# gives the same arcs as collapsing the full arc-length matrix, for a
+	# fraction of the work and memory.
 	tstart = time.time()
-	arc_lengths = calc_arc_lengths(avg_energies, parents)
-	
+	collapsed_avg_energies = collapse_avg_energies(
+		avg_energies, identical_sites, len(parents[0])
+	)
+	arc_lengths = calc_arc_lengths(
+		collapsed_avg_energies,
+		collapsed_parents,
+		packed=True,
+		max_length=max_fragment_diversity,
+	)
+
 	# ttot = time.time() - tstart
 	# print("# Arc lengths calculated in %1.2f sec" % ttot)
 	num_residues = len(collapsed_parents[0])
 
-	# Now collapse the arc lengths.  It is more efficient to
-	# do this before calculating the arc lengths, but for user-friendliness
-	# we do it now.
-	arc_lengths = collapse_matrix(arc_lengths, identical_sites)
-
 	# Iterate over all possible constraints on the fragment length
 	min_l_min = min_fragment_diversity
 	max_l_min = int(math.floor(num_residues / (num_crossovers + 1.0))) + 1
+	sweeps = []
 	for l_min in range(min_l_min, max_l_min + 1):
 		# print "l_min:", l_min, min_l_min, max_l_min
 		min_l_max = int(math.ceil(num_residues / (num_crossovers + 1.0)))
 		max_l_max = num_residues - num_crossovers * l_min + 1
-		for l_max in range(min_l_max, max_l_max + 1):
-			# print "  l_max:", l_max, min_l_max, max_l_max+1
-			# Find set of crossovers which minimize the average energy consistent with fragment-length constraints
-			res = get_shortest_path(
-				arc_lengths, collapsed_parents, num_crossovers, l_min, l_max
+		if max_fragment_diversity is not None:
+			max_l_max = min(max_l_max, max_fragment_diversity)
+		sweeps.append((l_min, min_l_max, max_l_max))
+	if workers > 1 and len(sweeps) > 1:
+		for sweep_results in parallel_sweeps(
+			arc_lengths,
+			collapsed_parents,
+			num_crossovers,
+			sweeps,
+			workers,
+			max_fragment_diversity,
+		):
+			results += sweep_results
+	else:
+		for (l_min, min_l_max, max_l_max) in sweeps:
+			results += sweep_l_max(
+				arc_lengths,
+				collapsed_parents,
+				num_crossovers,
+				l_min,
+				min_l_max,
+				max_l_max,
 			)
-			if res:
-				results.append(res)
 	# Convert results back into full-length parent indices
 	for i in range(len(results)):
 		(avg_E, collapsed_crossovers, l_min, l_max) = results[i]
 		crossovers = translate_collapsed_indices(collapsed_crossovers, identical_sites)
+		if counts:
+			avg_E = float(avg_E) / len(parents) ** 2
 		results[i] = (avg_E, crossovers, l_min, l_max)
 	return results
 
 
+# State installed in each worker process by init_sweep_worker.
+sweep_worker_state = {}
+
+
+def parallel_sweeps(
+	arc_lengths, parents, num_crossovers, sweeps, workers, max_length=None
+):
+	"""Runs sweep_l_max for each (l_min, min_l_max, max_l_max) in sweeps on a
+	pool of worker processes, returning the results in the order of sweeps.
+
+	The upper triangle of the arc lengths, or only the band up to max_length,
+	is copied once into shared memory, which every worker reads, rather than
+	being pickled with each task."""
+	num_residues = len(arc_lengths)
+	# The same layout as calc_arc_lengths chose for this max_length
+	width = band_width(num_residues, max_length)
+	if width is None:
+		size = num_residues * (num_residues + 1) // 2
+	else:
+		size = num_residues * width
+	shm = shared_memory.SharedMemory(create=True, size=max(size, 1) * 8)
+	try:
+		flat = shm.buf.cast("d")
+		start = 0
+		for i in range(num_residues):
+			if width is None:
+				row = arc_lengths[i][i:]
+			else:
+				start = i * width
+				row = arc_lengths[i][i : i + width]
+			flat[start : start + len(row)] = array.array("d", row)
+			start += len(row)
+		flat.release()
+		with ProcessPoolExecutor(
+			max_workers=min(workers, len(sweeps)),
+			initializer=init_sweep_worker,
+			initargs=(shm.name, num_residues, width, parents, num_crossovers),
+		) as executor:
+			return list(executor.map(run_sweep_worker, sweeps))
+	finally:
+		shm.close()
+		shm.unlink()
+
+
+def init_sweep_worker(shm_name, num_residues, width, parents, num_crossovers):
+	shm = shared_memory.SharedMemory(name=shm_name)
+	# Rows are views into the shared block, so arc_lengths[i][j] reads
+	# straight from it.
+	if width is None:
+		arc_lengths = triangular_rows(shm.buf.cast("d"), num_residues)
+	else:
+		arc_lengths = banded_rows(shm.buf.cast("d"), num_residues, width)
+	sweep_worker_state["shm"] = shm
+	sweep_worker_state["arc_lengths"] = arc_lengths
+	sweep_worker_state["parents"] = parents
+	sweep_worker_state["num_crossovers"] = num_crossovers
+
+
+def run_sweep_worker(sweep):
+	(l_min, min_l_max, max_l_max) = sweep
+	return sweep_l_max(
+		sweep_worker_state["arc_lengths"],
+		sweep_worker_state["parents"],
+		sweep_worker_state["num_crossovers"],
+		l_min,
+		min_l_max,
+		max_l_max,
+	)
+
+
+def sweep_l_max(arc_lengths, parents, num_crossovers, l_min, min_l_max, max_l_max):
+	"""Finds the shortest path for every l_max from min_l_max to max_l_max with
+	a fixed l_min, returning the results in order of increasing l_max.
+
+	Lowering l_max only removes paths, so the optimum for one l_max remains
+	the optimum, tie-breaking included, for every smaller l_max down to its
+	longest fragment.  The sweep therefore starts from the loosest constraint
+	and only solves again once l_max drops below the longest fragment of the
+	current optimum; if no path is allowed, none is for smaller l_max either."""
+	num_residues = len(parents[0])
+	results = []
+	l_max = max_l_max
+	while l_max >= min_l_max:
+		# Find set of crossovers which minimize the average energy consistent with fragment-length constraints
+		res = get_shortest_path(arc_lengths, parents, num_crossovers, l_min, l_max)
+		if not res:
+			break
+		(avg_energy, crossovers) = res[:2]
+		# The crossovers are 1-based, so crossover c begins a fragment at c-1.
+		starts = [0] + [c - 1 for c in crossovers] + [num_residues]
+		longest = max([starts[k + 1] - starts[k] for k in range(len(starts) - 1)])
+		# Every l_max in [longest, l_max] shares this optimum.
+		for shared_l_max in range(l_max, max(longest, min_l_max) - 1, -1):
+			results.append((avg_energy, crossovers[:], l_min, shared_l_max))
+		l_max = longest - 1
+	results.reverse()
+	return results
+
+
 def get_shortest_path(arc_lengths, parents, num_crossovers, l_min, l_max):
 	"""Finds the set of crossovers which minimizes the average library energy.
 
 	Exactly num_crossovers crossovers will be found, and they will satisfy the
 	constraints that no resulting fragment be shorter than l_min or longer
-	than l_max."""
-	debug = False
+	than l_max.  Only arcs spanning at most l_max residues are read, so
+	arc_lengths may be a band matrix from calc_arc_lengths with a max_length
+	of at least l_max."""
 	num_residues = len(parents[0])
 
-	paths = []
+	# The graph has one column of nodes per crossover.  Node j of column k
+	# is the k+1-th crossover, starting a new fragment at residue j.
+	# costs[k][j] is the length of the shortest allowable path to that node,
+	# or None if there is none, and backpointers[k][j] is the node in column
+	# k-1 on that path.  Only the optimal path is assembled, at the end.
+	costs = []
+	backpointers = []
+
 	# First column:
-	for i in range(num_residues):
-		# The shortest path to each node in the first column is
-		# just the arc length to that column.
-		#
-		# i represents the 0-based index of the beginning of
-		# the new fragment.  E.g., i=5 means that the first
-		# fragment begins at residue 0 and ends at residue 4
-		# (length = 5), and the next fragment begins at res. 5.
-		length = i
-		if l_min <= length <= l_max:
-			p = Path([i], arc_lengths[0][i])
-			paths.append(p)
+	# The shortest path to each node in the first column is
+	# just the arc length to that column.
+	#
+	# i represents the 0-based index of the beginning of
+	# the new fragment.  E.g., i=5 means that the first
+	# fragment begins at residue 0 and ends at residue 4
+	# (length = 5), and the next fragment begins at res. 5.
+	# Node j of column k can only be on an allowable path if the k+1
+	# fragments before it and the num_crossovers-k fragments after it all
+	# have lengths in [l_min, l_max], which bounds j to a window.  Near the
+	# tightest l_max, where every fragment must be close to l_max long, the
+	# windows are narrow and most of the graph is skipped.
+	def window(k):
+		lo = max((k + 1) * l_min, num_residues - (num_crossovers - k) * l_max, 0)
+		hi = min((k + 1) * l_max, num_residues - (num_crossovers - k) * l_min)
+		return (lo, hi)
+
+	cost = [None] * (num_residues + 1)
+	(lo, hi) = window(0)
+	for i in range(lo, min(hi, num_residues - 1) + 1):
+		cost[i] = arc_lengths[0][i]
+	costs.append(cost)
+	backpointers.append(None)
 
 	# The shortest path to column k given the SPs to column k-1
 	# is the one having min_i {SP^(k-1)_i + A(i,j)}.  (This path
 	# ends at node j of column k.)
-
-	# Goal: given SP to all nodes in col k-1, compute shortest path
-	# to all nodes j in col k.
-	# The paths
 	for k in range(1, num_crossovers):
-		if debug:
-			print("k=%d" % k)
-			for p in paths:
-				print("%s\t%1.2f" % (p.frag_lengths(parents[0]), p.length))
-		# The only allowable range for node j is where previous
-		# fragments satisfy the length constraints.  There have
-		# been k of them so far, so j >= k*l_min.
-		min_j = k * l_min
-		# There will be num_crossovers+1-k fragments after, and
-		# those fragments, if minimum length, cannot go past
-		# the end of the protein, so j <= num_residues-(num_crossovers-k+1)*l_min.
-		# For example, if there are 50 residues, this is the third
-		# crossover of four, and l_min = 10, then j must be no more than 30.
-		max_j = num_residues - (num_crossovers - k) * l_min + 1
-		# print "minj, maxj", min_j, max_j
-		# At the beginning of this loop, paths contains the set of shortest
-		# paths that are allowable and end nodes given by the final entry
-		# in the .indices element of each Path object in shortest_paths.
-		# At the end of this loop, shortest_paths will contain the set of shortest paths
-		# that are allowable and end at nodes j.
-		shortest_paths = []
-		for j in range(min_j, max_j):
-			best_path = None  # Path([], HUGE_NUMBER)
-			for p in paths:
-				i = p.indices[-1]
-				# Track the shortest path
-				frag_length = j - i
-				if l_min <= frag_length <= l_max:
-					# This is an allowable path
-					# If it's shorter than the shortest path so far, save it
-					if not best_path or p.length + arc_lengths[i][j] < best_path.length:
-						best_path = Path(p.indices + [j], p.length + arc_lengths[i][j])
-			# If at least one allowable path was found, we've got a shortest path to j.
-			if best_path:  # .length < HUGE_NUMBER:
-				shortest_paths.append(best_path)
-		# Now start all over again with this new set of shortest paths to column k.
-		paths = shortest_paths
-
-	if debug:
-		print("final")
-		for p in paths:
-			print("%s\t%1.2f" % (p.frag_lengths(parents[0]), p.length))
-		# for i in range(len(paths)):
-		# 	print "      %d\t%s\t%1.2f" % (i, paths[i].frag_lengths(parents[0]), paths[i].length)
-
-	# Now filter out paths with illegal last-fragment lengths
-	allowable_paths = []
-	for p in paths:
-		final_frag_length = num_residues - p.indices[-1]
-		if l_min <= final_frag_length <= l_max:
-			allowable_paths.append(p)
-	paths = allowable_paths
-
-	# Find the minimum path length
-	lengths = [p.length for p in paths]
-	if len(lengths) > 0:
-		(avg_energy, i) = min_index(lengths)
-		# frag_lengths = paths[i].frag_lengths(parents[0])
-		# if min(frag_lengths) < l_min or max(frag_lengths)>l_max:
-		# 	print "Illegal lengths: min %d, max %d, actual %s" % (l_min, l_max, frag_lengths)
-		return (avg_energy, paths[i].crossovers(), l_min, l_max)
-	else:
+		(prev_lo, prev_hi) = (lo, hi)
+		(lo, hi) = window(k)
+		prev_cost = cost
+		cost = [None] * (num_residues + 1)
+		backpointer = [None] * (num_residues + 1)
+		for j in range(lo, hi + 1):
+			# Only nodes i in the window [j - l_max, j - l_min] of the previous
+			# column leave an allowable fragment length j - i.  Ties go to the
+			# smallest i.
+			best_length = None
+			best_i = None
+			for i in range(max(j - l_max, prev_lo), min(j - l_min, prev_hi) + 1):
+				length = prev_cost[i]
+				if length is None:
+					continue
+				length += arc_lengths[i][j]
+				if best_length is None or length < best_length:
+					best_length = length
+					best_i = i
+			cost[j] = best_length
+			backpointer[j] = best_i
+		costs.append(cost)
+		backpointers.append(backpointer)
+
+	# Now find the shortest path among those with a legal last-fragment
+	# length.  Ties go to the smallest final crossover.
+	avg_energy = None
+	best_j = None
+	for j in range(max(num_residues - l_max, 0), num_residues - l_min + 1):
+		length = cost[j]
+		if length is not None and (avg_energy is None or length < avg_energy):
+			avg_energy = length
+			best_j = j
+	if best_j is None:
 		return None
 
+	# Follow the backpointers to recover the crossovers.
+	indices = [best_j]
+	for k in range(len(costs) - 1, 0, -1):
+		indices.append(backpointers[k][indices[-1]])
+	indices.reverse()
+	return (avg_energy, Path(indices, avg_energy).crossovers(), l_min, l_max)
+
 
 def curve(results, parents, bin_width, max_samples=1e10):
 	"""Compute a curve of average energy and average mutation, with the latter binned
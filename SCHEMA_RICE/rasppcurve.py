@@ -38,11 +38,14 @@ ARG_MULTIPLE_SEQUENCE_ALIGNMENT_FILE = 'msa'
 ARG_CONTACT_FILE = 'con'
 ARG_OUTPUT_FILE = 'o'
 ARG_MIN_FRAGMENT_SIZE = 'min'
+ARG_MAX_FRAGMENT_SIZE = 'max'
 ARG_NUM_LIBRARIES = 'libs'
 ARG_MAX_CHIMERAS_PER_LIBRARY = 'chims'
 ARG_BIN_WIDTH = "bin"
 ARG_NUM_CROSSOVERS = 'xo'
 ARG_RANDOM_SEED = 'seed'
+ARG_NUM_THREADS = 'threads'
+ARG_NUM_THREADS_SHORT = 'j'
 ARG_COMPARE = 'compare'  # Unused
 ARG_HELP = 'help'
 
@@ -73,7 +76,9 @@ def print_usage(args):
 		'\t[-%s <random number seed>]\n' % ARG_RANDOM_SEED, \
 		'\t[-%s <max. chimeras generated per library>]\n' % ARG_MAX_CHIMERAS_PER_LIBRARY, \
 		'\t[-%s <min. fragment length>]\n' % ARG_MIN_FRAGMENT_SIZE, \
+		'\t[-%s <max. fragment length>]\n' % ARG_MAX_FRAGMENT_SIZE, \
 		'\t[-%s <bin width>]\n' % ARG_BIN_WIDTH, \
+		'\t[-%s|-%s <# processes>]\n' % (ARG_NUM_THREADS_SHORT, ARG_NUM_THREADS), \
 		'\t[-%s <output file>]' % ARG_OUTPUT_FILE)
 
 
@@ -145,6 +150,12 @@ def main(args):
 		output_file.write("# No minimum fragment length specified; using L=4.\n")
 		min_length = 4
 
+	# Get the maximum fragment size, if any.
+	if ARG_MAX_FRAGMENT_SIZE in arg_dict:
+		max_length = int(arg_dict[ARG_MAX_FRAGMENT_SIZE])
+	else:
+		max_length = None
+
 	# Get the bin width
 	if ARG_BIN_WIDTH in arg_dict:
 		bin_width = float(arg_dict[ARG_BIN_WIDTH])
@@ -152,6 +163,14 @@ def main(args):
 		output_file.write("# No bin width specified; using bin width=1.0.\n")
 		bin_width = 1.0
 
+	# Get the number of processes to run RASPP on.
+	if ARG_NUM_THREADS in arg_dict:
+		num_threads = int(arg_dict[ARG_NUM_THREADS])
+	elif ARG_NUM_THREADS_SHORT in arg_dict:
+		num_threads = int(arg_dict[ARG_NUM_THREADS_SHORT])
+	else:
+		num_threads = 1
+
 	# Get the number of fragments -- one more than the number of crossovers.
 	num_fragments = int(arg_dict[ARG_NUM_CROSSOVERS])+1
 	
@@ -160,20 +179,27 @@ def main(args):
 	library_size = num_parents**num_fragments
 
 	# Make libraries consistent with RASPP
-	(new_parents, identical_sites) = raspp.collapse_parents(parents)
+	alignment = schema.Alignment(parents)
+	(new_parents, identical_sites) = raspp.collapse_parents(alignment)
 	if len(new_parents[0]) < num_fragments * min_length:
 		error_msg = "Minimum fragment length of %d is too large.\n%d " + \
 					"fragments with length %d cannot be found in a " + \
 					"sequence of length %d (with identities removed).  Aborting..."
 		print(error_msg % (min_length, num_fragments, min_length, len(parents[0])))
 		return
+	if max_length is not None and len(new_parents[0]) > num_fragments * max_length:
+		error_msg = "Maximum fragment length of %d is too small.\n%d " + \
+					"fragments with length %d cannot cover a " + \
+					"sequence of length %d (with identities removed).  Aborting..."
+		print(error_msg % (max_length, num_fragments, max_length, len(new_parents[0])))
+		return
 
-	contacts = schema.getSCHEMAContacts(pdb_contacts, parents)
-	energies = raspp.make_4d_energies(contacts, parents)
-	avg_energies = raspp.calc_average_energies(energies, parents)
+	contacts = schema.getSCHEMAContacts(pdb_contacts, alignment)
+	energies = raspp.make_4d_energies(contacts, alignment)
+	penalty_counts = raspp.calc_penalty_counts(energies)
 
 	tstart = time.time()
-	res = raspp.RASPP(avg_energies, parents, num_fragments-1, min_length)
+	res = raspp.RASPP(penalty_counts, parents, num_fragments-1, min_length, workers=num_threads, max_fragment_diversity=max_length, counts=True)
 	output_file.write("# RASPP took %1.2f secs\n" % (time.time()-tstart,))
 	output_file.write("# RASPP found %d results\n" % (len(res),))
 
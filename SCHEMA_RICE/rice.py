@@ -1,7 +1,7 @@
 #!/usr/local/bin/python
 
 
-import argparse, sys, time, schema, raspp, pdb_reader
+import argparse, sys, time, schema, raspp, pdb_reader, schemautil
 from pathlib import Path
 
 SUCCESS = 0
@@ -33,8 +33,7 @@ def main():
 	
 	# otherwise use provided contact file
 	pdb_contacts = None
-	with open(contacts_path, "r") as file:
-		pdb_contacts = schema.readContactFile(file)
+	pdb_contacts = read_input_file(contacts_path, schema.readContactFile)
 
 	# sort where output will be sent 
 	if args.o is None:
@@ -43,6 +42,8 @@ def main():
 		output_file = open(args.o, "w")
 
 	output_file.write(f"# Minimum fragment length = {args.min}\n")
+	if args.max is not None:
+		output_file.write(f"# Maximum fragment length = {args.max}\n")
 	output_file.write(f"# Using bin width = {args.bin}\n")
 	output_file.write(f"# Number of crossovers = {args.xo}\n")
 
@@ -61,16 +62,25 @@ def find_optimal_crossovers(args, parents, pdb_contacts, output_file):
 	num_fragments = args.xo + 1
 
 	# Make libraries consistent with raspp
-	(new_parents, identical_sites) = raspp.collapse_parents(parents)
+	alignment = schema.Alignment(parents)
+	(new_parents, identical_sites) = raspp.collapse_parents(alignment)
 	new_parents_are_valid(new_parents, num_fragments, parents, args) # will exit if fails
 	
-	contacts = schema.getSCHEMAContacts(pdb_contacts, parents)
-	energies = raspp.make_4d_energies(contacts, parents)
+	contacts = schema.getSCHEMAContacts(pdb_contacts, alignment)
+	energies = raspp.make_4d_energies(contacts, alignment)
 	
-	avg_energies = raspp.calc_average_energies(energies, parents)
+	penalty_counts = raspp.calc_penalty_counts(energies)
 
 	tstart = time.time()
-	res = raspp.RASPP(avg_energies, parents, num_fragments - 1, args.min)
+	res = raspp.RASPP(
+		penalty_counts,
+		parents,
+		num_fragments - 1,
+		args.min,
+		workers=args.threads,
+		max_fragment_diversity=args.max,
+		counts=True,
+	)
 	 
 	output_file.write("# RASPP took %1.2f secs\n" % (time.time() - tstart,))
 	output_file.write("# RASPP found %d results\n" % (len(res),))
@@ -98,6 +108,15 @@ def new_parents_are_valid(new_parents, num_fragments, parents, args):
 		print(error_msg % (args.min, num_fragments, args.min, len(parents[0])))
 		exit(FAILED_COLLAPSE_ERROR)
 
+	if args.max is not None and len(new_parents[0]) > num_fragments * args.max:
+		error_msg = (
+			"Maximum fragment length of %d is too small.\n%d "
+			+ "fragments with length %d cannot cover a "
+			+ "sequence of length %d (with identities removed).  Aborting..."
+		)
+		print(error_msg % (args.max, num_fragments, args.max, len(new_parents[0])))
+		exit(FAILED_COLLAPSE_ERROR)
+
 
 def generate_contacts(args, parent_dict: dict):
 	"""acts as a wrapper for original schemacontacts.py but streamlines
@@ -105,11 +124,12 @@ def generate_contacts(args, parent_dict: dict):
 
 	chain_identifiers = format_chain_identifiers(args)
 
-	residues = None
-	with open(args.pdb, "r") as pdb_file:
-		residues = pdb_reader.File().read(pdb_file)
+	pdb = pdb_reader.File()
+	residues = read_input_file(
+		args.pdb, lambda f: pdb.read(f, arrays=True, chains=chain_identifiers)
+	)
 
-	aligned_prot, aligned_pdb, pdb_key = align_pdb_residues(args, parent_dict)
+	aligned_prot, aligned_pdb, pdb_key = align_pdb_residues(args, parent_dict, pdb.header)
 
 	aligned_prot_is_valid(aligned_prot, pdb_key, parent_dict)
 	aligned_pdb_is_valid(aligned_pdb, pdb_key, residues, chain_identifiers, args)
@@ -161,12 +181,12 @@ def aligned_pdb_is_valid(aligned_pdb, pdb_key, residues, chain_identifiers, args
 		exit(PDB_ALIGN_ERROR)
 
 
-def align_pdb_residues(args, parent_dict: dict):
+def align_pdb_residues(args, parent_dict: dict, pdb_header: dict):
 	"""
 	Because the PDB file's residue sequence may differ from those of the parents, we
 	must align the PDB residues to one parent."""
 
-	pdb_key = find_pdb_key(args)
+	pdb_key = find_pdb_key(args, pdb_header)
 
 	aligned_prot = None
 	aligned_pdb = None
@@ -185,8 +205,9 @@ def align_pdb_residues(args, parent_dict: dict):
 		# Pull information from the parent/PDB alignment file.
 		# Our objective is to find the sequence with the same key in both the parent MSA file and
 		# the parent/PDB alignment file.
-		with open(args.pdbal, "r") as par_pdb_file:
-			pdb_parent_seq_list = schema.readMultipleSequenceAlignmentFile(par_pdb_file)
+		pdb_parent_seq_list = read_input_file(
+			args.pdbal, schema.readMultipleSequenceAlignmentFile
+		)
 
 		pdb_parent_seqs = dict(pdb_parent_seq_list)
 
@@ -228,8 +249,7 @@ def read_parent_aln(args):
 	The parents will appear in the list in the order in which they appear in the file.
 	"""
 
-	with open(args.msa, "r") as msa_f:
-		parents = schema.readMultipleSequenceAlignmentFile(msa_f)
+	parents = read_input_file(args.msa, schema.readMultipleSequenceAlignmentFile)
 
 	parent_dict = dict(parents)
 	return parents, parent_dict
@@ -253,10 +273,11 @@ def format_chain_identifiers(args):
 	return chain_identifiers
 
 
-def find_pdb_key(args):
+def find_pdb_key(args, pdb_header: dict):
 	"""Will either return as None indicating that a parent
-	to PDB sequence was already given, otherwise it extracts
-	the PDB key from the HEADER field of the PDB file"""
+	to PDB sequence was already given, otherwise it takes
+	the PDB key from the HEADER field of the PDB file, as
+	read into pdb_header"""
 
 	# the alignment between the reference parent
 	# (indicated by reference_parent_index) and the target protein
@@ -267,8 +288,7 @@ def find_pdb_key(args):
 	# contained in the HEADER field corresponds to one of the
 	# sequence IDs in the MSA.
 	if args.pdbal is None:
-		with open(args.pdb, "r") as pdb_file_name:
-			return pdb_reader.File().getIDCode(pdb_file_name)
+		return pdb_header.get("id_code")
 
 	return None
 
@@ -285,14 +305,14 @@ def setup_parser():
 		type=validate_file,
 		required=True,
 		action="store",
-		help="A PDB file from the Protein Data Bank",
+		help="A PDB file from the Protein Data Bank, optionally gzip or bzip2 compressed",
 	)
 	parser.add_argument(
 		"-msa",
 		type=validate_file,
 		required=True,
 		action="store",
-		help="A multiple sequence alignment in ALN format (e.g. ClustalW)",
+		help="A multiple sequence alignment in ALN format (e.g. ClustalW), optionally gzip or bzip2 compressed",
 	)
 	parser.add_argument(
 		"-xo", type=int, required=True, action="store", help="The number of crossovers"
@@ -303,7 +323,7 @@ def setup_parser():
 		"-pdbal",
 		type=validate_file,
 		action="store",
-		help="(Optional) In ALN format. If this argument is not provided, then the PDB file's ID (e.g., 1G68) will be extracted, and the sequence having that ID in the multiple sequence alignment file will be used",
+		help="(Optional) In ALN format. If this argument is not provided, then the PDB file's ID (e.g., 1G68) will be extracted, and the sequence having that ID in the multiple sequence alignment file will be used. May be gzip or bzip2 compressed",
 	)
 	parser.add_argument(
 		"-chains",
@@ -319,6 +339,12 @@ def setup_parser():
 		type=int,
 		help="The minimum fragment length (minus invariant positions), in residues. Default min is 4",
 	)
+	parser.add_argument(
+		"-max",
+		action="store",
+		type=int,
+		help="(Optional) The maximum fragment length (minus invariant positions), in residues. By default fragments can be any length. Setting a maximum also reduces the memory RASPP needs for long sequences."
+	)
 	parser.add_argument(
 		"-bin",
 		action="store",
@@ -326,6 +352,15 @@ def setup_parser():
 		default=1,
 		help = "(Optional) The width of each average mutation bin. Default bin is 1."
 	)
+	parser.add_argument(
+		"-j",
+		"-threads",
+		dest="threads",
+		action="store",
+		type=int,
+		default=1,
+		help="(Optional) The number of processes RASPP runs on. Default is 1."
+	)
 	parser.add_argument(
 		"-o", action="store", 
 		metavar = "output.txt", 
@@ -337,17 +372,38 @@ def setup_parser():
 		action="store",
 		metavar="contacts.txt",
 		type = validate_file,
-		help = "(Optional) You can provide an existing contact file you have previously created. If not specified, rice.py will generate a new file called contacts.txt."
+		help = "(Optional) You can provide an existing contact file you have previously created. If not specified, rice.py will generate a new file called contacts.txt. May be gzip or bzip2 compressed."
 	)
 
 	return parser.parse_args()
 
 
+def read_input_file(path, read):
+	"""Returns read(f) for the input file at path, opened for reading.
+	If the file cannot be read, e.g. a truncated gzip or bzip2 file,
+	exits with error code INVALID_FILE"""
+
+	try:
+		with open(path, "r") as f:
+			return read(f)
+	except (OSError, EOFError, UnicodeDecodeError):
+		print(f"{path} could not be read. Aborting...")
+		exit(INVALID_FILE)
+
+
 def validate_file(path):
-	"""Check that a valid file has been provided,
-	otherwise exits with error code INVALID_FILE"""
+	"""Check that a valid file has been provided, and that the start
+	of it can be read if it is gzip or bzip2 compressed, otherwise exits
+	with error code INVALID_FILE.  Damage further into a compressed file
+	is caught when it is read (see read_input_file)"""
 
 	if (file := Path(path)).is_file():
+		try:
+			with open(file, "r") as f:
+				schemautil.openInput(f).readline()
+		except (OSError, EOFError, UnicodeDecodeError):
+			print(f"{path} could not be read. Aborting...")
+			exit(INVALID_FILE)
 		return file
 	else:
 		print(f"{path} is not a valid file. Aborting...")
@@ -35,7 +35,7 @@ Silberg, J. et al., "SCHEMA-guided protein recombination," Methods in Enzymology
 Endelman, J. et al., "Site-directed protein recombination as a shortest-path problem," Protein Engineering, Design & Selection 17(7):589-594 (2005).
 """
 
-import string, random, pdb_reader
+import array, heapq, math, string, random, operator, itertools, pdb_reader, schemautil
 
 DIGITS_LETTERS = string.digits + string.ascii_letters
 
@@ -178,10 +178,44 @@ def alignPDBResidues(
 	return new_residues
 
 
+class Alignment:
+	"""Aligned parent sequences stored as bytes, one ASCII code per residue.
+
+	encoded[k] holds parent k and columns[i] the residues of all parents at site
+	i.  conserved[i] is 1 where every parent has the same residue, and
+	variability[i] is the number of distinct residues at site i.  An Alignment
+	also behaves as the list of parent strings, so it can be passed wherever
+	parents are expected."""
+
+	def __init__(self, parents):
+		self.parents = list(parents)
+		self.encoded = [parent.encode("ascii") for parent in self.parents]
+		self.columns = [bytes(column) for column in zip(*self.encoded)]
+		self.variability = array.array("B", [len(set(column)) for column in self.columns])
+		self.conserved = bytes([v == 1 for v in self.variability])
+
+	def __len__(self):
+		return len(self.parents)
+
+	def __getitem__(self, key):
+		return self.parents[key]
+
+	def __iter__(self):
+		return iter(self.parents)
+
+
+def asAlignment(parents):
+	"""Returns parents as an Alignment, building one from a list of strings if needed."""
+	if isinstance(parents, Alignment):
+		return parents
+	return Alignment(parents)
+
+
 def getSCHEMAContactsWithCrossovers(contacts, parents, crossovers):
 	"""Get contacts with correction for parental sequence identity
 	and for fragments."""
 	fragments = getFragments(crossovers, parents[0])
+	conserved = asAlignment(parents).conserved
 
 	filtered_contacts = []
 	# First eliminate contacts between residues in the same fragment.  These
@@ -194,12 +228,7 @@ def getSCHEMAContactsWithCrossovers(contacts, parents, crossovers):
 		# Now eliminate contacts where either residue is absolutely conserved.
 		# These can never be broken by recombination.
 		if not same_fragment:
-			pi = [x[i] for x in parents]  # residue at that position for parents
-			pj = [x[j] for x in parents]
-
-			if not (
-				pi.count(pi[0]) == len(pi) or pj.count(pj[0]) == len(pj)
-			):  # if neither i or j absolutely conserved
+			if not (conserved[i] or conserved[j]):  # if neither i or j absolutely conserved
 				# This is a bona-fide breakable contact.
 				filtered_contacts.append((i, j, ri, rj))
 	return filtered_contacts
@@ -207,36 +236,63 @@ def getSCHEMAContactsWithCrossovers(contacts, parents, crossovers):
 
 def getSCHEMAContacts(contacts, parents):
 	"""Get contacts with correction for parental sequence identity."""
+	conserved = asAlignment(parents).conserved
 	filtered_contacts = []
 	# First eliminate contacts between residues in the same fragment.  These
 	# can never be broken by recombination.
 	for i, j, ri, rj in contacts:
 		# Eliminate contacts where either residue is absolutely conserved.
 		# These can never be broken by recombination.
-		pi = [x[i] for x in parents]
-		pj = [x[j] for x in parents]
 		# if neither i or j absolutely conserved
-		if not (pi.count(pi[0]) == len(pi) or pj.count(pj[0]) == len(pj)):
+		if not (conserved[i] or conserved[j]):
 			# This is a bona-fide breakable contact.
 			filtered_contacts.append((i, j, ri, rj))
 	return filtered_contacts
 
 
 def getPDBContacts(residues, contact_distance):
-	# Get set of residues within contact_distance angstroms in a PDB
-	contacts = []
-	# Loop through all residue pairs
-	for i in range(0, len(residues) - 1):
-		for j in range(i + 1, len(residues)):
-			resi = residues[i]
-			resj = residues[j]
-			# If both residues are present (gaps == None)
-			if resi and resj:
-				# If residues are within contact_distance angstroms of each other, add as a contact
-				contact = resi.isContact(resj, contact_distance)
-				if contact:
-					contacts.append((i, j, resi, resj))
+	"""Get set of residues within contact_distance angstroms in a PDB.  Returns
+	(i, j, resi, resj) for each pair of residues i < j that Residue.isContact
+	would report, in order of i and then j.
+
+	Rather than testing every pair of residues atom by atom, the atoms that
+	isContact considers are placed in a grid of cells contact_distance wide, so
+	that each atom need only be compared with the atoms in its own and the
+	adjacent cells."""
+	cell_size = contact_distance if contact_distance > 0 else 1.0
+	# Only the atoms considered by Residue.isContact are placed in the grid.
+	cells = {}
+	for index, residue in enumerate(residues):
+		# If the residue is present (gaps == None)
+		if not residue:
+			continue
+		for x, y, z in residue.contactCoordinates():
+			cell = (
+				int(math.floor(x / cell_size)),
+				int(math.floor(y / cell_size)),
+				int(math.floor(z / cell_size)),
+			)
+			cells.setdefault(cell, []).append((x, y, z, index))
+
+	neighbours = [
+		(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)
+	]
+	contact_pairs = set()
+	for (cx, cy, cz), cell_atoms in cells.items():
+		nearby_atoms = []
+		for dx, dy, dz in neighbours:
+			nearby_atoms.extend(cells.get((cx + dx, cy + dy, cz + dz), ()))
+		for x, y, z, i in cell_atoms:
+			for ox, oy, oz, j in nearby_atoms:
+				if i >= j or (i, j) in contact_pairs:
+					continue
+				# The same distance test as Residue.isContact
+				if math.sqrt((x - ox) ** 2 + (y - oy) ** 2 + (z - oz) ** 2) <= contact_distance:
+					contact_pairs.add((i, j))
 
+	contacts = []
+	for i, j in sorted(contact_pairs):
+		contacts.append((i, j, residues[i], residues[j]))
 	return contacts
 
 
@@ -251,8 +307,9 @@ def writeContactFile(contacts, outfile):
 
 
 def readContactFile(f):
+	"""Reads a contact file, which may be gzip or bzip2 compressed."""
 	contacts = []
-	for line in f.readlines():
+	for line in schemautil.openInput(f):
 		if line[0] == "#":  # comment line
 			continue
 		flds = line.strip().split()
@@ -295,6 +352,138 @@ def base(number, radix):
 	return "".join(result)
 
 
+def chimeraIndices(chimera):
+	"""Returns a chimera as a tuple of zero-based parent indices, one per fragment.
+	The chimera may be a block pattern such as '11213312' or already a sequence
+	of parent indices."""
+	if isinstance(chimera, str):
+		return tuple([int(c) - 1 for c in chimera])
+	return tuple(map(int, chimera))
+
+
+def chimeraBlocks(parent_indices):
+	"""Converts zero-based parent indices into a block pattern such as '11213312'."""
+	return "".join(["%d" % (q + 1,) for q in parent_indices])
+
+
+class ChimeraSpace:
+	"""The chimeras of a library with num_parents parents and num_fragments fragments,
+	in index order: chimera 0 is (0,0,...,0), chimera 1 is (0,...,0,1) and so on, with
+	the last fragment varying fastest.  Chimeras are tuples of zero-based parent
+	indices.  Slicing with a contiguous index range gives the corresponding part of
+	the space, e.g. for splitting the work into shards."""
+
+	def __init__(self, num_parents, num_fragments, start=0, stop=None):
+		self.num_parents = num_parents
+		self.num_fragments = num_fragments
+		self.size = num_parents**num_fragments
+		if stop is None:
+			stop = self.size
+		self.start = max(0, min(start, self.size))
+		self.stop = max(self.start, min(stop, self.size))
+
+	def __len__(self):
+		return self.stop - self.start
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			(start, stop, step) = key.indices(len(self))
+			if step != 1:
+				raise ValueError("ChimeraSpace slices must be contiguous")
+			return ChimeraSpace(
+				self.num_parents,
+				self.num_fragments,
+				self.start + start,
+				self.start + max(start, stop),
+			)
+		if key < 0:
+			key += len(self)
+		if not 0 <= key < len(self):
+			raise IndexError("chimera index out of range")
+		return self.chimera(self.start + key)
+
+	def __iter__(self):
+		if self.start == 0 and self.stop == self.size:
+			return itertools.product(range(self.num_parents), repeat=self.num_fragments)
+		return self._count()
+
+	def _count(self):
+		# Odometer over parent indices, starting at chimera self.start
+		digits = list(self.chimera(self.start))
+		last = self.num_parents - 1
+		for k in range(len(self)):
+			yield tuple(digits)
+			f = self.num_fragments - 1
+			while f >= 0 and digits[f] == last:
+				digits[f] = 0
+				f -= 1
+			if f >= 0:
+				digits[f] += 1
+
+	def chimera(self, index):
+		"""Returns the parent indices of the chimera with the given absolute index."""
+		digits = [0] * self.num_fragments
+		for f in range(self.num_fragments - 1, -1, -1):
+			(index, digits[f]) = divmod(index, self.num_parents)
+		return tuple(digits)
+
+	def index(self, chimera):
+		"""Returns the absolute index of a chimera given as a block pattern or parent indices."""
+		index = 0
+		for q in chimeraIndices(chimera):
+			index = index * self.num_parents + q
+		return index
+
+	def gray(self):
+		"""Yields (chimera, fragment) pairs for the chimeras of this space, the same
+		ones as iterating over it, in mixed-radix reflected Gray code order, in which
+		consecutive chimeras differ in the parent of one fragment.  fragment is the
+		index of the fragment changed from the previous chimera, or None for the
+		first.  A slice is split into aligned blocks of indices whose last fragments
+		take every parent; going from one block to the next can change several
+		fragments, also marked with None.  Suits scans that score chimeras
+		incrementally, e.g. with a ChimeraScorer."""
+		p = self.num_parents
+		n = self.num_fragments
+		digits = None
+		start = self.start
+		while start < self.stop:
+			# The largest block of p**k chimeras beginning at start, which
+			# varies the last k fragments over every parent.
+			k = 0
+			while k < n and start % p ** (k + 1) == 0 and start + p ** (k + 1) <= self.stop:
+				k += 1
+			block = list(self.chimera(start))
+			# Run each varying fragment from the end nearest its current parent.
+			directions = [1] * n
+			for f in range(n - k, n):
+				if digits is not None and digits[f] == p - 1:
+					block[f] = p - 1
+					directions[f] = -1
+			if digits is None:
+				changed = []
+			else:
+				changed = [f for f in range(n) if block[f] != digits[f]]
+			digits = block
+			yield (tuple(digits), changed[0] if len(changed) == 1 else None)
+			for i in range(p**k - 1):
+				f = n - 1
+				while not 0 <= digits[f] + directions[f] < p:
+					directions[f] = -directions[f]
+					f -= 1
+				digits[f] += directions[f]
+				yield (tuple(digits), f)
+			start += p**k
+
+	def batches(self, batch_size):
+		"""Yields the chimeras as lists of at most batch_size rows."""
+		chimeras = iter(self)
+		batch = list(itertools.islice(chimeras, batch_size))
+		while batch:
+			yield batch
+			batch = list(itertools.islice(chimeras, batch_size))
+
+
 def indexToFragment(index, fragments):
 	"""Given an index into a full protein sequence, returns the zero-based index of the
 	fragment containing that position."""
@@ -305,10 +494,34 @@ def indexToFragment(index, fragments):
 	return None
 
 
+def getContactDisruption(residue_i, residue_j, parent_pairs):
+	"""Returns the disruption of a contact whose residues in the chimera are
+	residue_i and residue_j, given the residue pairs found at the contact in
+	the parents: 0 if the pair is found in a parent, 0.5 if it is only
+	compatible with a parental pair, and 1 otherwise."""
+	pair = (residue_i, residue_j)
+	# If pair doesn't exist in any parent, it's counted as disruptive
+	if pair in parent_pairs:
+		return 0
+
+	comp_pairs = []
+	if residue_i in compatibility:
+		for rc in compatibility[residue_i]:
+			comp_pairs.append((rc, residue_j))
+	if residue_j in compatibility:
+		for rc in compatibility[residue_j]:
+			comp_pairs.append((residue_i, rc))
+
+	for parent_pair in parent_pairs:
+		if parent_pair in comp_pairs:
+			return 0.5
+	return 1
+
+
 def getChimeraDisruption(chimera_blocks, contacts, fragments, parents):
-	"""Takes a chimera block pattern, such as '11213312', and computes the SCHEMA
-	disruption, the number of contacts broken by recombination."""
-	parent_indices = [int(c) - 1 for c in chimera_blocks]
+	"""Takes a chimera block pattern, such as '11213312', or its parent indices and
+	computes the SCHEMA disruption, the number of contacts broken by recombination."""
+	parent_indices = chimeraIndices(chimera_blocks)
 	num_disruptions = 0
 
 	for i, j, ri, rj in contacts:
@@ -319,36 +532,21 @@ def getChimeraDisruption(chimera_blocks, contacts, fragments, parents):
 			# No disruption possible if both fragments come from the same parent.
 			continue
 
-		comp_pairs = [(parents[parent_indices[frag_i]][i], 
-				 parents[parent_indices[frag_j]][j])]
-		
-		if comp_pairs[0][0] in compatibility:
-					for rc in compatibility[comp_pairs[0][0]]:
-							comp_pairs.append((rc,comp_pairs[0][1]))
-		
-		if comp_pairs[0][1] in compatibility:
-					for rc in compatibility[comp_pairs[0][1]]:
-							comp_pairs.append((comp_pairs[0][0], rc))
-		
 		parent_pairs = [(p[i], p[j]) for p in parents]
-		
-		# If pair doesn't exist in any parent, it's counted as disruptive
-		if comp_pairs[0] not in parent_pairs:
-			for parent_pair in parent_pairs:
-				if parent_pair in comp_pairs[1:]:
-					num_disruptions += 0.5
-					break
-			else: 
-				num_disruptions += 1
-			
+		num_disruptions += getContactDisruption(
+			parents[parent_indices[frag_i]][i],
+			parents[parent_indices[frag_j]][j],
+			parent_pairs,
+		)
+
 	return num_disruptions
 
 
 def getChimeraSequence(chimera_blocks, fragments, parents):
-	"""Converts a chimera block pattern, such as '11213312', into a protein sequence
-	by assembling fragments from the parents.  This sequence may then be used
-	to compute mutational distances and so on."""
-	parent_indices = [int(c) - 1 for c in chimera_blocks]
+	"""Converts a chimera block pattern, such as '11213312', or its parent indices into
+	a protein sequence by assembling fragments from the parents.  This sequence may
+	then be used to compute mutational distances and so on."""
+	parent_indices = chimeraIndices(chimera_blocks)
 	chimera = ""
 	for i in range(len(parent_indices)):
 		which_parent = parent_indices[i]
@@ -371,10 +569,11 @@ def getChimeraShortestDistance(chimera_blocks, fragments, parents):
 
 
 def readMultipleSequenceAlignmentFile(f):
-	"""Reads a multiple sequence alignment file in ALN format."""
+	"""Reads a multiple sequence alignment file in ALN format, which may be gzip or
+	bzip2 compressed."""
 	parent_dict = {}
 	keys = []
-	for line in f.readlines():
+	for line in schemautil.openInput(f):
 		if line[0] == "#":  # comment line
 			continue
 		flds = line.strip().split()
@@ -428,36 +627,65 @@ def mutationMatrix(fragments, parents):
 
 
 def getChimeraShortestDistanceLookup(chimera_blocks, fragments, parents, mut_dict):
+	parent_indices = chimeraIndices(chimera_blocks)
 	ms = [0] * len(parents)
 	for p in range(len(parents)):
 		for f in range(len(fragments)):
-			q = int(chimera_blocks[f]) - 1
+			q = parent_indices[f]
 			if q != p:
 				key = (f, p, q)
 				ms[p] += mut_dict[key]
 	return min(ms)
 
 
+def _distanceVectorCounts(fragment_indices, mut_dict, num_parents):
+	# Tally, over every parent assignment of the given fragments, the vector
+	# of mutation distances to each parent.  Identical vectors are merged as
+	# fragments are added, so the tally stays far smaller than p^n.
+	counts = {(0,) * num_parents: 1}
+	for f in fragment_indices:
+		steps = [
+			tuple([0 if p == q else mut_dict[(f, p, q)] for p in range(num_parents)])
+			for q in range(num_parents)
+		]
+		new_counts = {}
+		for vector, count in counts.items():
+			for step in steps:
+				key = tuple(map(operator.add, vector, step))
+				new_counts[key] = new_counts.get(key, 0) + count
+		counts = new_counts
+	return counts
+
+
 def averageMutation(fragments, parents):
-	avg_m = 0.0
-	num_chimeras = 0
+	"""Computes the exact average mutation level <m> over all chimeras in the library.
+
+	The fragments are split into two halves and each half's distance vectors
+	(mutations to each parent) are tallied separately; every chimera is a
+	pairing of one vector from each half, whose m is the minimum of their sum.
+	Merging identical vectors makes this fast when the halves have few distinct
+	vectors, but every pairing of distinct vectors is still visited, which is
+	up to p^n work when they are all distinct: 4 parents and 15 fragments can
+	take minutes.  averageMutationSampled estimates <m> for such libraries."""
 	p = len(parents)
 	n = len(fragments)
-	# Create a mutation matrix: how many mutations
+	if p == 1:
+		# Every chimera is the parent itself
+		return 0.0
 	mut_dict = mutationMatrix(fragments, parents)
-	for i in range(p**n):
-		# The next two lines turn i into a chimera block pattern
-		# (e.g., 0 -> '11111111', 1 -> '11111112', 2 -> '11111113'...)
-		n2c = base(i, p)
-		chimera_blocks = "".join(
-			["1"] * (n - len(n2c)) + ["%d" % (int(x) + 1,) for x in n2c]
-		)
-		m = getChimeraShortestDistanceLookup(
-			chimera_blocks, fragments, parents, mut_dict
-		)
-		avg_m += m
-		num_chimeras += 1
-	return avg_m / num_chimeras
+	left = _distanceVectorCounts(range(n // 2), mut_dict, p)
+	right = _distanceVectorCounts(range(n // 2, n), mut_dict, p)
+	right_columns = list(zip(*right.keys()))
+	right_counts = list(right.values())
+	total_m = 0
+	for left_vector, left_count in left.items():
+		# Distances of every right-half vector to each parent, offset by this left half
+		shifted = [
+			map(operator.add, itertools.repeat(d), column)
+			for (d, column) in zip(left_vector, right_columns)
+		]
+		total_m += left_count * sum(map(operator.mul, right_counts, map(min, *shifted)))
+	return total_m / float(p**n)
 
 
 def averageMutationSampled(fragments, parents, num_samples):
@@ -472,38 +700,341 @@ def averageMutationSampled(fragments, parents, num_samples):
 	if num_samples >= library_size:  # Might as well be exact!
 		return averageMutation(fragments, parents)
 
+	chimera_space = ChimeraSpace(p, n)
 	for i in range(num_samples):
-		rand_num = random.randint(0, library_size)
-		# The next two lines turn i into a chimera block pattern
-		# (e.g., 0 -> '11111111', 1 -> '11111112', 2 -> '11111113'...)
-		n2c = base(rand_num, p)
-		chimera_blocks = "".join(
-			["1"] * (n - len(n2c)) + ["%d" % (int(x) + 1,) for x in n2c]
-		)
-		m = getChimeraShortestDistanceLookup(
-			chimera_blocks, fragments, parents, mut_dict
-		)
+		chimera = chimera_space[random.randint(0, library_size - 1)]
+		m = getChimeraShortestDistanceLookup(chimera, fragments, parents, mut_dict)
 		avg_m += m
 		num_chimeras += 1
 	return avg_m / num_chimeras
 
 
 def averageEnergy(contacts, fragments, parents):
-	avg_E = 0.0
-	num_chimeras = 0
+	"""Computes the exact average disruption <E> over all chimeras in the library.
+
+	A contact's disruption depends only on the parents of the two fragments
+	containing its residues, and across the library every ordered pair of
+	parents occurs equally often for any two fragments.  So rather than
+	enumerating all p^n chimeras, each contact contributes the mean of its
+	disruption over the p^2 parent pairs."""
 	p = len(parents)
-	n = len(fragments)
-	for i in range(len(parents) ** len(fragments)):
-		# The next two lines turn i into a chimera block pattern
-		# (e.g., 0 -> '11111111', 1 -> '11111112', 2 -> '11111113'...)
-		n2c = base(i, p)
-		chimera_blocks = "".join(
-			["1"] * (n - len(n2c)) + ["%d" % (int(x) + 1,) for x in n2c]
+	total_E = 0.0
+	for i, j, ri, rj in contacts:
+		if indexToFragment(i, fragments) == indexToFragment(j, fragments):
+			# Both residues always come from the same parent.
+			continue
+		residues_i = [parent[i] for parent in parents]
+		residues_j = [parent[j] for parent in parents]
+		parent_pairs = set(zip(residues_i, residues_j))
+		for a in range(p):
+			for b in range(p):
+				if a != b:
+					total_E += getContactDisruption(
+						residues_i[a], residues_j[b], parent_pairs
+					)
+	return total_E / p**2
+
+
+class DisruptionTable:
+	"""SCHEMA disruption compiled for fixed contacts and fragments.  A contact's
+	disruption depends only on the parents of the two fragments holding its
+	residues, so the contacts between each pair of fragments f < g are summed into
+	one table, pairs[k] = (f, g, table), with table[a*p + b] the disruption when f
+	comes from parent a and g from parent b.  A chimera's disruption is then one
+	lookup per pair of fragments in contact."""
+
+	def __init__(self, contacts, fragments, parents):
+		self.num_parents = len(parents)
+		self.num_fragments = len(fragments)
+		p = self.num_parents
+		tables = {}
+		for i, j, ri, rj in contacts:
+			frag_i = indexToFragment(i, fragments)
+			frag_j = indexToFragment(j, fragments)
+			if frag_i == frag_j:
+				# No disruption possible within a fragment.
+				continue
+			parent_pairs = [(q[i], q[j]) for q in parents]
+			if frag_i < frag_j:
+				key = (frag_i, frag_j)
+				cells = [(a, b) for a in range(p) for b in range(p)]
+			else:
+				key = (frag_j, frag_i)
+				cells = [(b, a) for a in range(p) for b in range(p)]
+			if key not in tables:
+				tables[key] = [0] * (p * p)
+			table = tables[key]
+			for k, (a, b) in enumerate(cells):
+				if a != b:
+					table[k] += getContactDisruption(
+						parents[a][i], parents[b][j], parent_pairs
+					)
+		self.pairs = [(f, g, tables[(f, g)]) for (f, g) in sorted(tables)]
+
+	def disruption(self, chimera):
+		"""Returns the disruption of a chimera given as a block pattern or parent indices."""
+		parent_indices = chimeraIndices(chimera)
+		p = self.num_parents
+		E = 0
+		for f, g, table in self.pairs:
+			E += table[parent_indices[f] * p + parent_indices[g]]
+		return E
+
+	def disruptions(self, chimeras):
+		"""Returns the disruptions of a sequence of chimeras as a list."""
+		p = self.num_parents
+		pairs = self.pairs
+		Es = []
+		for chimera in chimeras:
+			parent_indices = chimeraIndices(chimera)
+			E = 0
+			for f, g, table in pairs:
+				E += table[parent_indices[f] * p + parent_indices[g]]
+			Es.append(E)
+		return Es
+
+
+class MutationTable:
+	"""Mutation counts compiled for fixed fragments: distances[f][q] lists, for each
+	parent p, the mutations to p within fragment f when it is taken from parent q."""
+
+	def __init__(self, fragments, parents):
+		self.num_parents = len(parents)
+		self.num_fragments = len(fragments)
+		mut_dict = mutationMatrix(fragments, parents)
+		self.distances = [
+			[
+				tuple([0 if q == p else mut_dict[(f, p, q)] for p in range(self.num_parents)])
+				for q in range(self.num_parents)
+			]
+			for f in range(self.num_fragments)
+		]
+
+	def mutation(self, chimera):
+		"""Returns the mutations from a chimera to its closest parent."""
+		return self.mutations([chimera])[0]
+
+	def mutations(self, chimeras):
+		"""Returns the mutation levels m of a sequence of chimeras as a list."""
+		distances = self.distances
+		ms = []
+		for chimera in chimeras:
+			parent_indices = chimeraIndices(chimera)
+			rows = [distances[f][q] for (f, q) in enumerate(parent_indices)]
+			ms.append(min(map(sum, zip(*rows))))
+		return ms
+
+
+class ChimeraScorer:
+	"""Keeps the SCHEMA disruption E and the mutation distance to each parent of a
+	current chimera, updating them as single fragments change parent.  A change
+	only visits the contacts and mutation counts of the changed fragment, which
+	makes scanning a library in ChimeraSpace.gray() order cheap."""
+
+	def __init__(self, contacts, fragments, parents):
+		self.num_parents = len(parents)
+		self.num_fragments = len(fragments)
+		self.mutations = MutationTable(fragments, parents).distances
+		# For each fragment, the fragments in contact with it, as (other fragment,
+		# table) where table[a*p + b] is the disruption between the two when this
+		# fragment comes from parent a and the other from parent b.
+		p = self.num_parents
+		self.fragment_contacts = [[] for f in range(self.num_fragments)]
+		for f, g, table in DisruptionTable(contacts, fragments, parents).pairs:
+			self.fragment_contacts[f].append((g, table))
+			self.fragment_contacts[g].append(
+				(f, [table[a * p + b] for b in range(p) for a in range(p)])
+			)
+		self.chimera = [0] * self.num_fragments
+		self.energy = 0
+		self.distances = [0] * self.num_parents
+		self.reset([0] * self.num_fragments)
+
+	def reset(self, chimera):
+		"""Makes chimera, a block pattern or parent indices, the current chimera."""
+		self.chimera = list(chimeraIndices(chimera))
+		self.energy = 0
+		p = self.num_parents
+		for f, contacts in enumerate(self.fragment_contacts):
+			a = self.chimera[f] * p
+			for g, table in contacts:
+				if g > f:
+					self.energy += table[a + self.chimera[g]]
+		self.distances = [0] * self.num_parents
+		for f, q in enumerate(self.chimera):
+			self.distances = list(map(operator.add, self.distances, self.mutations[f][q]))
+
+	def change(self, fragment, parent):
+		"""Makes parent the source of the given fragment in the current chimera."""
+		old_parent = self.chimera[fragment]
+		if parent == old_parent:
+			return
+		chimera = self.chimera
+		new_row = parent * self.num_parents
+		old_row = old_parent * self.num_parents
+		delta = 0
+		for g, table in self.fragment_contacts[fragment]:
+			b = chimera[g]
+			delta += table[new_row + b] - table[old_row + b]
+		self.energy += delta
+		self.distances = list(
+			map(
+				operator.add,
+				self.distances,
+				map(
+					operator.sub,
+					self.mutations[fragment][parent],
+					self.mutations[fragment][old_parent],
+				),
+			)
 		)
-		E = getChimeraDisruption(chimera_blocks, contacts, fragments, parents)
-		avg_E += E
-		num_chimeras += 1
-	return avg_E / num_chimeras
+		chimera[fragment] = parent
+
+	def moveTo(self, chimera):
+		"""Changes every fragment that differs between the current chimera and chimera."""
+		for f, q in enumerate(chimera):
+			if q != self.chimera[f]:
+				self.change(f, q)
+
+	def disruption(self):
+		return self.energy
+
+	def mutation(self):
+		return min(self.distances)
+
+
+# The most recently compiled tables for scoreChimeras, keyed by its inputs
+compiled_score_tables = {}
+
+
+def scoreChimeras(chimeras, contacts, fragments, parents, chunk_size=10000):
+	"""Scores many chimeras at once.  chimeras may be any sequence or iterable of rows,
+	each a block pattern such as '11213312' or a sequence of zero-based parent indices
+	(e.g. the rows of an integer array).  Rows are read chunk_size at a time, so an
+	iterable need not be held in memory.  Returns (E, m), arrays of the disruption
+	and mutation level of each chimera.  The compiled tables are kept between calls
+	with the same contacts, fragments and parents."""
+	key = (
+		tuple([tuple(c) for c in contacts]),
+		tuple([tuple(f) for f in fragments]),
+		tuple(parents),
+	)
+	if key not in compiled_score_tables:
+		compiled_score_tables.clear()
+		compiled_score_tables[key] = (
+			DisruptionTable(contacts, fragments, parents),
+			MutationTable(fragments, parents),
+		)
+	(disruption_table, mutation_table) = compiled_score_tables[key]
+	Es = array.array("d")
+	ms = array.array("l")
+	rows = iter(chimeras)
+	chunk = [chimeraIndices(c) for c in itertools.islice(rows, chunk_size)]
+	while chunk:
+		Es.extend(disruption_table.disruptions(chunk))
+		ms.extend(mutation_table.mutations(chunk))
+		chunk = [chimeraIndices(c) for c in itertools.islice(rows, chunk_size)]
+	return (Es, ms)
+
+
+def filteredChimeras(contacts, fragments, parents, max_energy=None, min_mutation=None):
+	"""Yields (chimera, E, m) for the chimeras with E <= max_energy and m >= min_mutation,
+	in index order, with chimera a tuple of parent indices.  Either threshold may be
+	None.  Fragments are assigned one at a time and a partial chimera is abandoned as
+	soon as its disruption exceeds max_energy, since E can only grow as fragments are
+	added, or when even the most distant choice for the remaining fragments cannot
+	bring m up to min_mutation."""
+	p = len(parents)
+	n = len(fragments)
+	distances = MutationTable(fragments, parents).distances
+	# earlier[g]: (f, table) for the fragments f < g in contact with g
+	earlier = [[] for g in range(n)]
+	for f, g, table in DisruptionTable(contacts, fragments, parents).pairs:
+		earlier[g].append((f, table))
+	# remaining[f][k]: the most mutations to parent k that fragments f and later can add
+	remaining = [[0] * p for f in range(n + 1)]
+	for f in range(n - 1, -1, -1):
+		remaining[f] = [
+			remaining[f + 1][k] + max([distances[f][q][k] for q in range(p)])
+			for k in range(p)
+		]
+	chimera = [0] * n
+
+	def extend(f, E, dist):
+		if f == n:
+			yield (tuple(chimera), E, min(dist))
+			return
+		for a in range(p):
+			E_a = E
+			for g, table in earlier[f]:
+				E_a += table[chimera[g] * p + a]
+			if max_energy is not None and E_a > max_energy:
+				continue
+			dist_a = list(map(operator.add, dist, distances[f][a]))
+			if min_mutation is not None:
+				if min(map(operator.add, dist_a, remaining[f + 1])) < min_mutation:
+					continue
+			chimera[f] = a
+			for result in extend(f + 1, E_a, dist_a):
+				yield result
+
+	return extend(0, 0, [0] * p)
+
+
+def bestChimeras(contacts, fragments, parents, num_chimeras):
+	"""Returns the num_chimeras chimeras with the lowest disruption as a list of
+	(chimera, E, m), sorted by E.  Chimeras with equal E are ranked by higher m,
+	then by index.  chimera is a tuple of parent indices.
+
+	This is a best-first (A*) search over partial chimeras with the leading
+	fragments assigned.  Contacts between two assigned fragments give the exact
+	partial disruption; each unassigned fragment adds at least the smallest
+	disruption, over its possible parents, of its contacts with the assigned
+	fragments.  This bound never overestimates, so complete chimeras are
+	reached in order of E, and the search stops once no partial chimera can
+	match the worst E kept."""
+	p = len(parents)
+	n = len(fragments)
+	if num_chimeras <= 0:
+		return []
+	mutation_table = MutationTable(fragments, parents)
+	# later[f]: (g, table) for the fragments g > f in contact with f
+	later = [[] for f in range(n)]
+	for f, g, table in DisruptionTable(contacts, fragments, parents).pairs:
+		later[f].append((g, table))
+
+	# Each heap entry is (lower bound on E, -fragments assigned, order, E of the
+	# assigned fragments, chimera prefix, partial).  partial[g][b] is the
+	# disruption between the assigned fragments and unassigned fragment g if it
+	# comes from parent b.
+	heap = [(0, 0, 0, 0, (), [[0] * p for g in range(n)])]
+	order = 1
+	found = []
+	while heap:
+		(bound, depth, k, E, chimera, partial) = heapq.heappop(heap)
+		if len(found) >= num_chimeras and bound > found[num_chimeras - 1][0]:
+			break
+		f = len(chimera)
+		if f == n:
+			m = mutation_table.mutation(chimera)
+			found.append((E, -m, chimera))
+			continue
+		for a in range(p):
+			child_E = E + partial[f][a]
+			child_partial = list(partial)
+			for g, table in later[f]:
+				row = table[a * p : (a + 1) * p]
+				child_partial[g] = list(map(operator.add, partial[g], row))
+			child_bound = child_E
+			for g in range(f + 1, n):
+				child_bound += min(child_partial[g])
+			heapq.heappush(
+				heap,
+				(child_bound, -(f + 1), order, child_E, chimera + (a,), child_partial),
+			)
+			order += 1
+	found.sort()
+	return [(chimera, E, -m) for (E, m, chimera) in found[:num_chimeras]]
 
 
 def getCrossoversFromFragments(fragments):
@@ -589,3 +1120,26 @@ def mean(x):
 	if len(x) == 0:
 		raise ValueError("Cannot take average of zero-length list")
 	return sum(x) / float(len(x))
+
+
+class RunningStats:
+	"""Accumulates the mean of a stream of numbers without keeping them."""
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0
+
+	def add(self, values):
+		"""Adds a sequence of numbers to the accumulators."""
+		self.count += len(values)
+		self.total += sum(values)
+
+	def merge(self, other):
+		"""Adds the numbers accumulated by another RunningStats."""
+		self.count += other.count
+		self.total += other.total
+
+	def mean(self):
+		if self.count == 0:
+			raise ValueError("Cannot take average of zero-length list")
+		return self.total / float(self.count)
@@ -143,8 +143,8 @@ def main(args):
 		else:
 			parent_pdb_alignment_file = arg_dict[ARG_PDB_ALIGNMENT_FILE]
 	else:
-		with open(pdb_file, "r") as pdb_file_name:
-			pdb_key = pdb_reader.File().getIDCode(pdb_file_name)
+		# Taken from the PDB file's HEADER once it has been read
+		pdb_key = None
 
 	# The PDB chains
 	# Many PDB files include multiple chains.  The chain_identifier list includes those
@@ -169,8 +169,11 @@ def main(args):
 
 	# Generate the contacts
 	# Read in the PDB file to create a list of residues.
+	pdb = pdb_reader.File()
 	with open(pdb_file, "r") as file:
-		residues = pdb_reader.File().read(file)
+		residues = pdb.read(file, arrays=True, chains=chain_identifiers)
+	if not parent_pdb_alignment_file:
+		pdb_key = pdb.header.get("id_code")
 
 	# Because the PDB file's residue sequence may differ from those of the parents, we
 	# must align the PDB residues to one parent.
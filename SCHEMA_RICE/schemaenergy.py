@@ -30,20 +30,30 @@ Silberg, J. et al., "SCHEMA-guided protein recombination," Methods in Enzymology
 Endelman, J. et al., "Site-directed protein recombination as a shortest-path problem," Protein Engineering, Design & Selection 17(7):589-594 (2005).
 """
 
-import sys, os, schema
+import sys, os, itertools, schema
+from concurrent.futures import ProcessPoolExecutor
 
 ARG_PRINT_E = "E"
 ARG_PRINT_M = "m"
 ARG_PDB_ALIGNMENT_FILE = "pdbal"
 ARG_PARENT_INDEX = "p"
 ARG_CHIMERAS = "chim"
+ARG_AVERAGES_ONLY = "avg"
+ARG_MAX_ENERGY = "Emax"
+ARG_MIN_MUTATION = "mmin"
+ARG_BEST = "best"
 ARG_CROSSOVER_FILE = "xo"
 ARG_MULTIPLE_SEQUENCE_ALIGNMENT_FILE = "msa"
 ARG_CONTACT_FILE = "con"
 ARG_RANDOM_SEED = "seed"
 ARG_OUTPUT_FILE = "o"
+ARG_NUM_THREADS = "threads"
+ARG_NUM_THREADS_SHORT = "j"
 ARG_HELP = "help"
 
+# Chimeras are scored and written this many at a time
+CHIMERA_CHUNK_SIZE = 10000
+
 
 def parse_arguments(args):
 	# Turn linear arguments into a dictionary of (option, [values,...]) pairs
@@ -77,6 +87,11 @@ def print_usage(args):
 		"\t[-%s <chimera list>]\n" % ARG_CHIMERAS,
 		"\t[-%s]\n" % ARG_PRINT_E,
 		"\t[-%s]\n" % ARG_PRINT_M,
+		"\t[-%s <maximum disruption>]\n" % ARG_MAX_ENERGY,
+		"\t[-%s <minimum mutation>]\n" % ARG_MIN_MUTATION,
+		"\t[-%s <number of chimeras>]\n" % ARG_BEST,
+		"\t[-%s]\n" % ARG_AVERAGES_ONLY,
+		"\t[-%s|-%s <# processes>]\n" % (ARG_NUM_THREADS_SHORT, ARG_NUM_THREADS),
 		"\t[-%s <output file>]" % ARG_OUTPUT_FILE,
 	)
 
@@ -124,6 +139,54 @@ def confirm_arguments(arg_dict):
 				"  No output specified; use -E to print disruption and/or -m to print mutation"
 			)
 			res = False
+
+		for key in (ARG_MAX_ENERGY, ARG_MIN_MUTATION):
+			if key in arg_dict:
+				try:
+					float(arg_dict[key])
+				except (TypeError, ValueError):
+					print("  -%s requires a number" % key)
+					res = False
+
+		if ARG_BEST in arg_dict:
+			try:
+				if int(arg_dict[ARG_BEST]) < 1:
+					print("  -%s requires a positive number of chimeras" % ARG_BEST)
+					res = False
+			except (TypeError, ValueError):
+				print("  -%s requires a positive number of chimeras" % ARG_BEST)
+				res = False
+			if ARG_MAX_ENERGY in arg_dict or ARG_MIN_MUTATION in arg_dict:
+				print(
+					"  -%s cannot be combined with -%s or -%s"
+					% (ARG_BEST, ARG_MAX_ENERGY, ARG_MIN_MUTATION)
+				)
+				res = False
+			if ARG_CHIMERAS in arg_dict:
+				print("  -%s cannot be combined with -%s" % (ARG_BEST, ARG_CHIMERAS))
+				res = False
+
+		if ARG_AVERAGES_ONLY in arg_dict:
+			for key in (ARG_CHIMERAS, ARG_BEST):
+				if key in arg_dict:
+					print("  -%s cannot be combined with -%s" % (ARG_AVERAGES_ONLY, key))
+					res = False
+
+		# Only enumerating the whole library is spread over processes.
+		if ARG_NUM_THREADS in arg_dict or ARG_NUM_THREADS_SHORT in arg_dict:
+			for key in (
+				ARG_CHIMERAS,
+				ARG_MAX_ENERGY,
+				ARG_MIN_MUTATION,
+				ARG_BEST,
+				ARG_AVERAGES_ONLY,
+			):
+				if key in arg_dict:
+					print(
+						"  -%s/-%s cannot be combined with -%s"
+						% (ARG_NUM_THREADS_SHORT, ARG_NUM_THREADS, key)
+					)
+					res = False
 	except Exception as e:
 		raise e
 		res = False
@@ -131,30 +194,102 @@ def confirm_arguments(arg_dict):
 
 
 def outputEnergies(
-	chimera_blocks,
-	contacts,
+	chimeras,
+	disruption_table,
+	mutation_table,
 	fragments,
 	parents,
 	output_file,
 	output_string,
 	print_E,
 	print_m,
+	max_energy=None,
+	min_mutation=None,
 ):
-	if not schema.checkChimera(chimera_blocks, fragments, parents):
-		output_file.write("# %s is not a valid chimera\n" % chimera_blocks)
-		return
-	output_vars = [chimera_blocks]
-	E = None
-	m = None
+	"""Scores a chunk of chimera block patterns and writes their lines in one go.
+	Chimeras with E above max_energy or m below min_mutation are left out."""
+	valid_chimeras = [c for c in chimeras if schema.checkChimera(c, fragments, parents)]
+	if print_E or max_energy is not None:
+		Es = iter(disruption_table.disruptions(valid_chimeras))
+	if print_m or min_mutation is not None:
+		ms = iter(mutation_table.mutations(valid_chimeras))
+	lines = []
+	for chimera_blocks in chimeras:
+		if not schema.checkChimera(chimera_blocks, fragments, parents):
+			lines.append("# %s is not a valid chimera\n" % chimera_blocks)
+			continue
+		E = next(Es) if print_E or max_energy is not None else None
+		m = next(ms) if print_m or min_mutation is not None else None
+		if max_energy is not None and E > max_energy:
+			continue
+		if min_mutation is not None and m < min_mutation:
+			continue
+		output_vars = [chimera_blocks]
+		if print_E:
+			output_vars.append(E)
+		if print_m:
+			output_vars.append(m)
+		lines.append(output_string % tuple(output_vars))
+	output_file.write("".join(lines))
+
+
+def enumerateEnergies(chimera_space, scorer, output_string, print_E, print_m):
+	"""Scores a range of the library in Gray code order, so that most steps
+	change the parent of a single fragment.  Returns its output lines, in
+	index order, as one string, with RunningStats of its E and m values."""
+	size = len(chimera_space)
+	Es = [None] * size
+	ms = [None] * size
+	# The change in index when a fragment's parent changes by one
+	weights = [
+		chimera_space.num_parents ** (chimera_space.num_fragments - 1 - f)
+		for f in range(chimera_space.num_fragments)
+	]
+	for chimera, fragment in chimera_space.gray():
+		if fragment is None:
+			scorer.moveTo(chimera)
+			k = chimera_space.index(chimera) - chimera_space.start
+		else:
+			parent = chimera[fragment]
+			k += (parent - scorer.chimera[fragment]) * weights[fragment]
+			scorer.change(fragment, parent)
+		if print_E:
+			Es[k] = scorer.disruption()
+		if print_m:
+			ms[k] = scorer.mutation()
+	lines = []
+	for k, chimera in enumerate(chimera_space):
+		output_vars = [schema.chimeraBlocks(chimera)]
+		if print_E:
+			output_vars.append(Es[k])
+		if print_m:
+			output_vars.append(ms[k])
+		lines.append(output_string % tuple(output_vars))
+	E_stats = schema.RunningStats()
+	m_stats = schema.RunningStats()
 	if print_E:
-		E = schema.getChimeraDisruption(chimera_blocks, contacts, fragments, parents)
-		output_vars = output_vars + [E]
+		E_stats.add(Es)
 	if print_m:
-		m = schema.getChimeraShortestDistance(chimera_blocks, fragments, parents)
-		output_vars = output_vars + [m]
-	# print output_vars
-	output_file.write(output_string % tuple(output_vars))
-	return (E, m)
+		m_stats.add(ms)
+	return ("".join(lines), E_stats, m_stats)
+
+
+# Per-process state for parallel enumeration, set by init_enumeration_worker
+enumeration_worker_state = {}
+
+
+def init_enumeration_worker(contacts, fragments, parents, output_string, print_E, print_m):
+	enumeration_worker_state["scorer"] = schema.ChimeraScorer(contacts, fragments, parents)
+	enumeration_worker_state["space"] = schema.ChimeraSpace(len(parents), len(fragments))
+	enumeration_worker_state["args"] = (output_string, print_E, print_m)
+
+
+def run_enumeration_worker(index_range):
+	(start, stop) = index_range
+	state = enumeration_worker_state
+	return enumerateEnergies(
+		state["space"][start:stop], state["scorer"], *state["args"]
+	)
 
 
 def main(args):
@@ -173,11 +308,28 @@ def main(args):
 	#   The alignment/fragment file name.
 	msa_file = arg_dict[ARG_MULTIPLE_SEQUENCE_ALIGNMENT_FILE]
 
+	# Get the number of processes to enumerate chimeras on.
+	if ARG_NUM_THREADS in arg_dict:
+		num_threads = int(arg_dict[ARG_NUM_THREADS])
+	elif ARG_NUM_THREADS_SHORT in arg_dict:
+		num_threads = int(arg_dict[ARG_NUM_THREADS_SHORT])
+	else:
+		num_threads = 1
+
 	if ARG_PRINT_E in arg_dict:
 		print_E = True
 	if ARG_PRINT_M in arg_dict:
 		print_m = True
 
+	# Thresholds for the chimeras to report
+	max_energy = None
+	min_mutation = None
+	if ARG_MAX_ENERGY in arg_dict:
+		max_energy = float(arg_dict[ARG_MAX_ENERGY])
+	if ARG_MIN_MUTATION in arg_dict:
+		min_mutation = float(arg_dict[ARG_MIN_MUTATION])
+	filtering = max_energy is not None or min_mutation is not None
+
 	# Read the alignment file to create a list of parents.
 	# The parents will appear in the list in the order in which they appear in the file.
 	with open(msa_file, "r") as file:
@@ -196,6 +348,19 @@ def main(args):
 	if ARG_OUTPUT_FILE in arg_dict:
 		output_file = open(arg_dict[ARG_OUTPUT_FILE], "w")
 
+	if ARG_AVERAGES_ONLY in arg_dict and not filtering:
+		# Only the library averages are wanted, and these can be computed
+		# exactly without enumerating the chimeras.
+		if print_E:
+			average_E = schema.averageEnergy(contacts, fragments, parents)
+			output_file.write("# Average disruption <E> = %1.4f\n" % average_E)
+		if print_m:
+			average_m = schema.averageMutation(fragments, parents)
+			output_file.write("# Average mutation <m> = %1.4f\n" % average_m)
+		if ARG_OUTPUT_FILE in arg_dict:
+			output_file.close()
+		return
+
 	# Now, what does the user want?
 	output_string = "%s"
 	output_file.write("# chimera")
@@ -209,81 +374,126 @@ def main(args):
 	output_file.write("\n")
 
 	if ARG_CHIMERAS in arg_dict:  # Print values for chimeras
+		disruption_table = schema.DisruptionTable(contacts, fragments, parents)
+		mutation_table = schema.MutationTable(fragments, parents)
 		chimeras = arg_dict[ARG_CHIMERAS]
 		# Could be a) a chimera, b) a list of chimeras, or c) a file of chimeras.
 		if type(chimeras) is list:
 			# It's a list of chimeras
-			for chimera_blocks in chimeras:
-				outputEnergies(
-					chimera_blocks,
-					contacts,
-					fragments,
-					parents,
-					output_file,
-					output_string,
-					print_E,
-					print_m,
-				)
+			chimera_file = None
 		elif os.path.isfile(chimeras):
-			# It's a file of chimeras
-			with open(chimeras, "r") as file:
-				for line in file.readlines():
-					chimera_blocks = line.strip()
-					outputEnergies(
-						chimera_blocks,
-						contacts,
-						fragments,
-						parents,
-						output_file,
-						output_string,
-						print_E,
-						print_m,
-					)
+			# It's a file of chimeras, read a chunk at a time
+			chimera_file = open(chimeras, "r")
+			chimeras = (line.strip() for line in chimera_file)
 		else:
 			# It's a single chimera sequence
-			chimera_blocks = chimeras
+			chimera_file = None
+			chimeras = [chimeras]
+		chimeras = iter(chimeras)
+		chunk = list(itertools.islice(chimeras, CHIMERA_CHUNK_SIZE))
+		while chunk:
 			outputEnergies(
-				chimera_blocks,
-				contacts,
-				fragments,
-				parents,
-				output_file,
-				output_string,
-				print_E,
-				print_m,
-			)
-	else:
-		# Enumerates all possible chimeras and their disruption and mutation values.
-		p = len(parents)
-		n = len(fragments)
-		Es = []
-		ms = []
-		for i in range(len(parents) ** len(fragments)):
-			# The next two lines turn i into a chimera block pattern
-			# (e.g., 0 -> '11111111', 1 -> '11111112', 2 -> '11111113'...)
-			n2c = schema.base(i, p)
-			chimera_blocks = "".join(
-				["1"] * (n - len(n2c)) + ["%d" % (int(x) + 1,) for x in n2c]
-			)
-			(E, m) = outputEnergies(
-				chimera_blocks,
-				contacts,
+				chunk,
+				disruption_table,
+				mutation_table,
 				fragments,
 				parents,
 				output_file,
 				output_string,
 				print_E,
 				print_m,
+				max_energy,
+				min_mutation,
 			)
+			chunk = list(itertools.islice(chimeras, CHIMERA_CHUNK_SIZE))
+		if chimera_file:
+			chimera_file.close()
+	elif ARG_BEST in arg_dict:
+		# The lowest-disruption chimeras, found without enumerating the library.
+		num_best = int(arg_dict[ARG_BEST])
+		lines = []
+		for chimera, E, m in schema.bestChimeras(contacts, fragments, parents, num_best):
+			output_vars = [schema.chimeraBlocks(chimera)]
 			if print_E:
-				Es.append(E)
+				output_vars.append(E)
 			if print_m:
-				ms.append(m)
+				output_vars.append(m)
+			lines.append(output_string % tuple(output_vars))
+		output_file.write("".join(lines))
+	elif filtering:
+		# Enumerates only the chimeras meeting the thresholds, skipping whole
+		# groups of chimeras that share a disqualifying set of leading fragments.
+		# With -avg, only the averages over these chimeras are printed.
+		list_chimeras = not ARG_AVERAGES_ONLY in arg_dict
+		E_stats = schema.RunningStats()
+		m_stats = schema.RunningStats()
+		results = schema.filteredChimeras(
+			contacts, fragments, parents, max_energy, min_mutation
+		)
+		chunk = list(itertools.islice(results, CHIMERA_CHUNK_SIZE))
+		while chunk:
+			lines = []
+			for chimera, E, m in chunk:
+				output_vars = [schema.chimeraBlocks(chimera)]
+				if print_E:
+					output_vars.append(E)
+				if print_m:
+					output_vars.append(m)
+				lines.append(output_string % tuple(output_vars))
+			if list_chimeras:
+				output_file.write("".join(lines))
+			E_stats.add([E for (chimera, E, m) in chunk])
+			m_stats.add([m for (chimera, E, m) in chunk])
+			chunk = list(itertools.islice(results, CHIMERA_CHUNK_SIZE))
+		if E_stats.count == 0:
+			output_file.write("# No chimeras meet the thresholds\n")
+		else:
+			output_file.write("# %d chimeras meet the thresholds\n" % E_stats.count)
+			if print_E:
+				mean_str = "# Average disruption <E> = %1.4f\n" % E_stats.mean()
+				output_file.write(mean_str)
+			if print_m:
+				mean_str = "# Average mutation <m> = %1.4f\n" % m_stats.mean()
+				output_file.write(mean_str)
+	else:
+		# Enumerates all possible chimeras and their disruption and mutation values,
+		# a chunk of the index range at a time.  Each chunk is scored in Gray code
+		# order, in which consecutive chimeras differ in one fragment, so their
+		# values are updated from the previous chimera rather than recomputed.
+		chimera_space = schema.ChimeraSpace(len(parents), len(fragments))
+		index_ranges = [
+			(start, start + CHIMERA_CHUNK_SIZE)
+			for start in range(0, len(chimera_space), CHIMERA_CHUNK_SIZE)
+		]
+		E_stats = schema.RunningStats()
+		m_stats = schema.RunningStats()
+		if num_threads > 1 and len(index_ranges) > 1:
+			# Chunks are scored by worker processes; map returns them in order.
+			executor = ProcessPoolExecutor(
+				max_workers=num_threads,
+				initializer=init_enumeration_worker,
+				initargs=(contacts, fragments, parents, output_string, print_E, print_m),
+			)
+			with executor:
+				chunk_results = executor.map(run_enumeration_worker, index_ranges)
+				for text, chunk_E_stats, chunk_m_stats in chunk_results:
+					output_file.write(text)
+					E_stats.merge(chunk_E_stats)
+					m_stats.merge(chunk_m_stats)
+		else:
+			scorer = schema.ChimeraScorer(contacts, fragments, parents)
+			for start, stop in index_ranges:
+				(text, chunk_E_stats, chunk_m_stats) = enumerateEnergies(
+					chimera_space[start:stop], scorer, output_string, print_E, print_m
+				)
+				output_file.write(text)
+				E_stats.merge(chunk_E_stats)
+				m_stats.merge(chunk_m_stats)
 		if print_E:
-			mean_str = "# Average disruption <E> = %1.4f\n" % schema.mean(Es)
+			mean_str = "# Average disruption <E> = %1.4f\n" % E_stats.mean()
 			output_file.write(mean_str)
 		if print_m:
-			mean_str = "# Average mutation <m> = %1.4f\n" % schema.mean(ms)
+			mean_str = "# Average mutation <m> = %1.4f\n" % m_stats.mean()
 			output_file.write(mean_str)
 
 	if ARG_OUTPUT_FILE in arg_dict:
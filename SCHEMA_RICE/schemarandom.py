@@ -181,7 +181,8 @@ def main(args):
 		random.seed(int(arg_dict[ARG_RANDOM_SEED]))
 
 	# Make libraries consistent with RASPP
-	(new_parents, identical_sites) = raspp.collapse_parents(parents)
+	alignment = schema.Alignment(parents)
+	(new_parents, identical_sites) = raspp.collapse_parents(alignment)
 	if len(new_parents[0]) < num_fragments * min_length:
 		error_msg = (
 			"Minimum diversity length of %d is too large.\n%d "
@@ -204,49 +205,31 @@ def main(args):
 	for crossovers in random_crossovers:
 		fragments = schema.getFragments(crossovers, parents[0])
 		filtered_contacts = schema.getSCHEMAContactsWithCrossovers(
-			pdb_contacts, parents, crossovers
+			pdb_contacts, alignment, crossovers
 		)
-		all_chimeras = []
 		if max_chimeras < library_size:
 			# Assemble a random sample of chimeras, with replacement
+			chimera_space = schema.ChimeraSpace(num_parents, num_fragments)
+			all_chimeras = []
 			for n_chim in range(max_chimeras):
 				chim_index = random.randint(0, library_size - 1)
-				n2c = schema.base(chim_index, num_parents)
-				chimera_blocks = "".join(
-					["1"] * (num_fragments - len(n2c))
-					+ ["%d" % (int(x) + 1,) for x in n2c]
-				)
-				all_chimeras.append(chimera_blocks)
-		else:  # We'll be covering all chimeras in the library; might as well get a good sample.
-			# The number of parents and fragments specifies all possible chimeras, regardless of
-			# crossover point positions, so pre-generate all chimeras.
-			max_chimeras = library_size
-			for i in range(library_size):
-				# The next two lines turn i into a chimera block pattern
-				# (e.g., 0 -> '11111111', 1 -> '11111112', 2 -> '11111113'...)
-				n2c = schema.base(i, num_parents)
-				chimera_blocks = "".join(
-					["1"] * (num_fragments - len(n2c))
-					+ ["%d" % (int(x) + 1,) for x in n2c]
-				)
-				all_chimeras.append(chimera_blocks)
-			# Randomly assort the chimeras
-			random.shuffle(all_chimeras)
-
-		# Calculate average E and m for the library or subsample
-		E_values = []
-		m_values = []
-
-		for chim_index in range(max_chimeras):
-			chimera_blocks = all_chimeras[chim_index]
-			E = schema.getChimeraDisruption(
-				chimera_blocks, filtered_contacts, fragments, parents
+				all_chimeras.append(chimera_space[chim_index])
+
+			# Calculate average E and m for the subsample
+			disruption_table = schema.DisruptionTable(
+				filtered_contacts, fragments, parents
 			)
-			m = schema.getChimeraShortestDistance(chimera_blocks, fragments, parents)
-			E_values.append(E)
-			m_values.append(m)
-		average_E = schema.mean(E_values)
-		average_m = schema.mean(m_values)
+			E_values = disruption_table.disruptions(all_chimeras)
+			mutation_table = schema.MutationTable(fragments, parents)
+			m_values = mutation_table.mutations(all_chimeras)
+			average_E = schema.mean(E_values)
+			average_m = schema.mean(m_values)
+		else:  # We'll be covering all chimeras in the library.
+			# The library averages can be computed exactly without scoring
+			# each chimera.
+			max_chimeras = library_size
+			average_E = schema.averageEnergy(filtered_contacts, fragments, parents)
+			average_m = schema.averageMutation(fragments, parents)
 		xover_pat = "%d " * len(crossovers)
 		xover_str = xover_pat % tuple(crossovers)
 		output_file.write(("%1.4f\t%1.4f\t%s\n") % (average_E, average_m, xover_str))
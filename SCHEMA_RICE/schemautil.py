@@ -1,6 +1,23 @@
 #! /usr/local/bin/python
 
-import random
+import bz2, gzip, io, random
+
+# Leading bytes identifying compressed input files
+compressed_formats = [(b'\x1f\x8b', gzip.open), (b'BZh', bz2.open)]
+
+def openInput(f):
+	"""Returns a text file reading f, a file opened for reading in text mode,
+	decompressing it if it is gzip or bzip2 data as detected from its first bytes.
+	An uncompressed file is returned as it is.  Closing f closes the returned file's
+	data source, so f should be used as the context manager."""
+	buffer = getattr(f, 'buffer', None)
+	if buffer is None or not hasattr(buffer, 'peek'):
+		return f
+	start = buffer.peek(3)
+	for magic, opener in compressed_formats:
+		if start.startswith(magic):
+			return io.TextIOWrapper(opener(buffer), encoding=f.encoding, errors=f.errors)
+	return f
 
 def random_contact_map(length, num_contacts):
 	# Generate a random contact map
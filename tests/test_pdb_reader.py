@@ -0,0 +1,38 @@
+import io, os, sys, unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP_DIR, "SCHEMA_RICE"))
+
+import pdb_reader
+
+# Residue 35A has alternate locations and an insertion code
+PDB_LINES = """HEADER    OXIDOREDUCTASE                          27-JUN-06   2HI4
+ATOM      1  N   ARG A  34      21.304  30.140  -9.153  1.00 58.60           N
+ATOM      2  CA  ARG A  34      20.753  29.652  -7.854  1.00 57.66           C
+ATOM      3  N  AGLY A  35A     22.014  31.608  -6.690  0.50 54.53           N
+ATOM      4  N  BGLY A  35A     22.114  31.708  -6.790  0.50 54.53           N
+ATOM      5  CA  GLY B  36      23.100  32.000  -5.500  1.00 50.00           C
+"""
+
+ATOM_FIELDS = ["x", "y", "z", "atom_name", "chain", "alt_loc", "res_seq", "icode", "residue", "res_id"]
+
+
+class TestAtomView(unittest.TestCase):
+	def test_same_fields_as_atom(self):
+		atoms = [a for r in pdb_reader.File().read(io.StringIO(PDB_LINES)) for a in r.atoms]
+		views = [
+			a
+			for r in pdb_reader.File().read(io.StringIO(PDB_LINES), arrays=True)
+			for a in r.atoms
+		]
+		self.assertEqual(len(atoms), 5)
+		self.assertEqual(len(views), 5)
+		for atom, view in zip(atoms, views):
+			for field in ATOM_FIELDS:
+				self.assertEqual(getattr(view, field), getattr(atom, field), field)
+		self.assertEqual([v.alt_loc for v in views], [" ", " ", "A", "B", " "])
+		self.assertEqual([v.icode for v in views], [" ", " ", "A", "A", " "])
+
+
+if __name__ == "__main__":
+	unittest.main()
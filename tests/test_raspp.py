@@ -0,0 +1,149 @@
+import os, random, sys, unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(TOP_DIR, "data")
+sys.path.insert(0, os.path.join(TOP_DIR, "SCHEMA_RICE"))
+
+import pdb_reader, raspp, schema
+
+CONTACT_DISTANCE = 4.5
+
+
+def read_p450():
+	"""Returns the P450 parents and their contacts in the 2HI4 structure."""
+	with open(os.path.join(DATA_DIR, "p450_msa.txt"), "r") as f:
+		parent_list = schema.readMultipleSequenceAlignmentFile(f)
+	parent_dict = dict(parent_list)
+	with open(os.path.join(DATA_DIR, "1a1_2hi4_aln.txt"), "r") as f:
+		pdb_alignment = dict(schema.readMultipleSequenceAlignmentFile(f))
+	chains = ["A", " "]
+	with open(os.path.join(DATA_DIR, "2HI4.pdb"), "r") as f:
+		residues = pdb_reader.File().read(f, arrays=True, chains=chains)
+	residues = schema.alignPDBResidues(
+		residues, pdb_alignment["1A1"], pdb_alignment["2HI4"], parent_dict["1A1"], chains
+	)
+	contacts = schema.getPDBContacts(residues, CONTACT_DISTANCE)
+	return ([p for (k, p) in parent_list], contacts)
+
+
+def random_parents(num_parents, length, rng):
+	"""Returns related random parents, each site mutated with probability 0.3."""
+	residues = "ACDEFGHIKLMNPQRSTVWY"
+	first = [rng.choice(residues) for i in range(length)]
+	parents = ["".join(first)]
+	for p in range(num_parents - 1):
+		parents.append(
+			"".join([rng.choice(residues) if rng.random() < 0.3 else r for r in first])
+		)
+	return parents
+
+
+def average_energies(contacts, parents):
+	alignment = schema.Alignment(parents)
+	schema_contacts = schema.getSCHEMAContacts(contacts, alignment)
+	energies = raspp.make_4d_energies(schema_contacts, alignment)
+	return (energies, raspp.calc_average_energies(energies, parents))
+
+
+class TestArcLengths(unittest.TestCase):
+	def assertMatchesLibraryEnergy(self, avg_energies, parents, pairs):
+		num_residues = len(parents[0])
+		arc_lengths = raspp.calc_arc_lengths(avg_energies, parents)
+		avg_energy_matrix = raspp.avg_energy_list_to_matrix(avg_energies, num_residues)
+		for r1, r2 in pairs:
+			expected = raspp.calc_average_library_energy(
+				avg_energy_matrix, num_residues, r1, r2
+			)
+			self.assertAlmostEqual(arc_lengths[r1][r2], expected, places=9)
+
+	def test_p450(self):
+		(parents, contacts) = read_p450()
+		(energies, avg_energies) = average_energies(contacts, parents)
+		self.assertTrue(avg_energies)
+		# calc_average_library_energy is O(L^2) per arc, so check a grid of arcs
+		grid = range(0, len(parents[0]), 23)
+		pairs = [(r1, r2) for r1 in grid for r2 in grid if r1 < r2]
+		pairs += [(0, len(parents[0]) - 1), (1, 2)]
+		self.assertMatchesLibraryEnergy(avg_energies, parents, pairs)
+
+	def test_three_parents(self):
+		rng = random.Random(1)
+		parents = random_parents(3, 60, rng)
+		contacts = set()
+		while len(contacts) < 150:
+			(i, j) = sorted(rng.sample(range(60), 2))
+			contacts.add((i, j, None, None))
+		contacts = sorted(contacts)
+		(energies, avg_energies) = average_energies(contacts, parents)
+		num_residues = len(parents[0])
+		pairs = [(r1, r2) for r1 in range(num_residues) for r2 in range(r1 + 1, num_residues)]
+		self.assertMatchesLibraryEnergy(avg_energies, parents, pairs)
+
+		# Arcs built from the penalty counts are exact whole numbers.
+		arc_lengths = raspp.calc_arc_lengths(raspp.calc_penalty_counts(energies), parents)
+		for r1, r2 in pairs:
+			count = 0
+			for c in range(len(energies.contacts)):
+				(i, j, ri, rj) = energies.contacts[c]
+				if r1 <= i < r2 <= j:
+					count += sum(energies.contact_penalties(c))
+			self.assertEqual(arc_lengths[r1][r2], count)
+
+	def test_packed_and_banded(self):
+		rng = random.Random(2)
+		parents = random_parents(3, 40, rng)
+		contacts = [(i, j, None, None) for i in range(40) for j in range(i + 2, 40, 5)]
+		(energies, avg_energies) = average_energies(contacts, parents)
+		full = raspp.calc_arc_lengths(avg_energies, parents)
+		packed = raspp.calc_arc_lengths(avg_energies, parents, packed=True)
+		banded = raspp.calc_arc_lengths(avg_energies, parents, max_length=7)
+		for r1 in range(40):
+			for r2 in range(r1 + 1, 40):
+				self.assertEqual(packed[r1][r2], full[r1][r2])
+				if r2 - r1 <= 7:
+					self.assertEqual(banded[r1][r2], full[r1][r2])
+
+
+class TestRASPP(unittest.TestCase):
+	def setUp(self):
+		rng = random.Random(3)
+		self.parents = random_parents(3, 60, rng)
+		contacts = [(i, j, None, None) for i in range(60) for j in range(i + 2, 60, 4)]
+		alignment = schema.Alignment(self.parents)
+		schema_contacts = schema.getSCHEMAContacts(contacts, alignment)
+		energies = raspp.make_4d_energies(schema_contacts, alignment)
+		self.counts = raspp.calc_penalty_counts(energies)
+
+	def test_max_fragment_diversity_beyond_length(self):
+		# A maximum at least the sequence length constrains nothing, and must
+		# not allocate a band wider than the sequence.
+		unbounded = raspp.RASPP(self.counts, self.parents, 3, 3, counts=True)
+		for workers in (1, 2):
+			bounded = raspp.RASPP(
+				self.counts,
+				self.parents,
+				3,
+				3,
+				workers=workers,
+				max_fragment_diversity=10**8,
+				counts=True,
+			)
+			self.assertEqual(bounded, unbounded)
+
+	def test_max_fragment_diversity(self):
+		unbounded = raspp.RASPP(self.counts, self.parents, 3, 3, counts=True)
+		for workers in (1, 2):
+			bounded = raspp.RASPP(
+				self.counts,
+				self.parents,
+				3,
+				3,
+				workers=workers,
+				max_fragment_diversity=10,
+				counts=True,
+			)
+			self.assertEqual(bounded, [res for res in unbounded if res[3] <= 10])
+
+
+if __name__ == "__main__":
+	unittest.main()
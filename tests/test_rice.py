@@ -0,0 +1,50 @@
+import bz2, gzip, os, subprocess, sys, tempfile, unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(TOP_DIR, "data")
+RICE = os.path.join(TOP_DIR, "SCHEMA_RICE", "rice.py")
+INVALID_FILE = 2
+
+
+class TestCompressedInput(unittest.TestCase):
+	def setUp(self):
+		self.tmp_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(self.tmp_dir.cleanup)
+
+	def write(self, name, data):
+		path = os.path.join(self.tmp_dir.name, name)
+		with open(path, "wb") as f:
+			f.write(data)
+		return path
+
+	def read_data(self, name):
+		with open(os.path.join(DATA_DIR, name), "rb") as f:
+			return f.read()
+
+	def rice(self, pdb, msa):
+		# rice.py writes contacts.txt to the working directory
+		return subprocess.run(
+			[sys.executable, RICE, "-pdb", pdb, "-msa", msa, "-xo", "6", "-min", "4"]
+			+ ["-pdbal", os.path.join(DATA_DIR, "1a1_2hi4_aln.txt")],
+			cwd=self.tmp_dir.name,
+			capture_output=True,
+			text=True,
+		)
+
+	def test_truncated_archive(self):
+		# The start of the archive decompresses, so only reading it all fails
+		pdb = self.write("2HI4.pdb.gz", gzip.compress(self.read_data("2HI4.pdb"))[:2000])
+		result = self.rice(pdb, os.path.join(DATA_DIR, "p450_msa.txt"))
+		self.assertEqual(result.returncode, INVALID_FILE)
+		self.assertIn("could not be read", result.stdout)
+		self.assertNotIn("Traceback", result.stderr)
+
+	def test_truncated_alignment(self):
+		msa = self.write("msa.txt.bz2", bz2.compress(self.read_data("p450_msa.txt"))[:400])
+		result = self.rice(os.path.join(DATA_DIR, "2HI4.pdb"), msa)
+		self.assertEqual(result.returncode, INVALID_FILE)
+		self.assertNotIn("Traceback", result.stderr)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,25 @@
+import itertools, os, sys, unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP_DIR, "SCHEMA_RICE"))
+
+import schema
+
+
+class TestAverageMutation(unittest.TestCase):
+	def test_matches_enumeration(self):
+		parents = ["ABCDEFGHIK", "ABDDEGGHLK", "CBCDFFGAIM"]
+		fragments = [(0, 3), (3, 5), (5, 8), (8, 10)]
+		total = 0
+		for chimera in itertools.product(range(3), repeat=4):
+			total += schema.getChimeraShortestDistance(chimera, fragments, parents)
+		self.assertAlmostEqual(
+			schema.averageMutation(fragments, parents), total / 3.0**4
+		)
+
+	def test_single_parent(self):
+		self.assertEqual(schema.averageMutation([(0, 3), (3, 6)], ["ABCDEF"]), 0.0)
+
+
+if __name__ == "__main__":
+	unittest.main()